@@ -1,8 +1,17 @@
 #!/usr/bin/env python
+import asyncio
 import logging
 
 from src.whatsapp import create_app
 
+try:
+    import uvloop
+
+    # The agent event loop is created under this policy; uvloop speeds up its I/O
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:  # uvloop is not available on Windows
+    pass
+
 app = create_app()
 
 if __name__ == "__main__":
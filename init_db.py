@@ -1,13 +1,15 @@
 from dotenv import load_dotenv
 import os
 import asyncio
+
+# Standalone entry point: load .env before supabase_client reads it
+load_dotenv()
+
 from src.db.supabase_client import supabase
 from rich.console import Console
 
 console = Console()
 
-load_dotenv()
-
 
 async def init_database():
     """Initialize the database with basic data necessary for operation"""
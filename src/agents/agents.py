@@ -1,103 +1,172 @@
-from dotenv import load_dotenv
+from collections import deque
+import asyncio
+import functools
+import inspect
 import json
 import time
 import logging
+import orjson
 import os
-from rich.console import Console
+import queue
+import re
+import sys
+import threading
+from rich.console import Console, Group
 from rich.panel import Panel
-from agents import Agent, Runner, handoff, RunContextWrapper
+from agents import Agent, ModelSettings, Runner, handoff, RunContextWrapper
 from dataclasses import dataclass, field
-from typing import List, Dict, Any, Optional
-from pydantic import BaseModel
-from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional
+from pydantic import BaseModel, ConfigDict
 import uuid
 from ..db.database import (
     get_products,
-    create_purchase,
-    get_purchase_types,
+    find_product,
     generate_sales_report,
 )
-from ..payments.mp import create_mercadopago_link
+from ..payments.checkout import prepare_payment
+from ..flags import VERBOSE_LOGS
 
 # Configure logging to suppress specific messages
 logging.basicConfig(level=logging.ERROR)
 logging.getLogger("openai").setLevel(logging.ERROR)
 logging.getLogger("agents").setLevel(logging.ERROR)
 
-# Load environment variables
-load_dotenv()
-
+# .env is loaded by src.whatsapp.config, which src.whatsapp imports before
+# this module, so the variables below are already set
 # Set environment variable to disable traces if no API key
-if "OPENAI_API_KEY" not in os.environ or not os.environ["OPENAI_API_KEY"]:
+_TRACE_DISABLED = not os.environ.get("OPENAI_API_KEY")
+if _TRACE_DISABLED:
     os.environ["OPENAI_API_TRACE_ENABLED"] = "false"
 
+# The Product Agent only matches names against the catalog; a small model is enough
+PRODUCT_AGENT_MODEL = os.environ.get("PRODUCT_AGENT_MODEL", "gpt-4.1-mini")
+
 console = Console()
+# Verbose Rich output follows VERBOSE_LOGS (see env_flag); when off, the log
+# helpers return before building any string
+_VERBOSE = VERBOSE_LOGS
+
+# Agent names double as AGENT_STYLES keys, so they are interned once here
+MAIN_AGENT_NAME = sys.intern("Main Agent")
+PRODUCT_AGENT_NAME = sys.intern("Product Agent")
+SALES_AGENT_NAME = sys.intern("Sales Agent")
+REPORTS_AGENT_NAME = sys.intern("Reports Agent")
+
+AGENT_STYLES = {
+    MAIN_AGENT_NAME: {"icon": "🧠", "color": "bold cyan"},
+    PRODUCT_AGENT_NAME: {"icon": "🔍", "color": "bold green"},
+    SALES_AGENT_NAME: {"icon": "💰", "color": "bold yellow"},
+    REPORTS_AGENT_NAME: {"icon": "📈", "color": "bold magenta"},
+}
+DEFAULT_AGENT_STYLE = {"icon": "👤", "color": "bold white"}
+
+# (icon, color) and message template per log_agent_activity type
+ACTIVITY_STYLES = {
+    "started": ("▶️", "blue"),
+    "thinking": ("💭", "yellow"),
+    "action": ("⚙️", "cyan"),
+    "completed": ("✅", "green"),
+    "error": ("❌", "red"),
+}
+DEFAULT_ACTIVITY_STYLE = ("ℹ️", "white")
+_ACTIVITY_MESSAGES = {
+    "started": "[bold {color}]Starting processing[/]",
+    "thinking": "[italic {color}]Analyzing '{details}'[/]",
+    "action": "[bold {color}]Executing {details}[/]",
+    "completed": "[bold {color}]Processing completed[/]",
+    "error": "[bold {color}]Error: {details}[/]",
+}
+
+# Renderables are printed by a background thread so Rich layout and terminal
+# writes stay off the request path. A thread (not an asyncio task) is used
+# so code outside the agent event loop can log through the same queue.
+_LOG_Q: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+LOG_BATCH_SIZE = 32
+
+
+def _log_worker() -> None:
+    while True:
+        batch = [_LOG_Q.get()]
+        # Whatever queued up meanwhile is rendered in the same print call
+        while len(batch) < LOG_BATCH_SIZE:
+            try:
+                batch.append(_LOG_Q.get_nowait())
+            except queue.Empty:
+                break
+        console.print(batch[0] if len(batch) == 1 else Group(*batch))
+
+
+if _VERBOSE:
+    threading.Thread(target=_log_worker, name="agent-log-writer", daemon=True).start()
+
+
+def _enqueue_log(*renderables: Any) -> None:
+    """Queues renderables for the background log writer"""
+    if _VERBOSE:
+        _LOG_Q.put_nowait(
+            renderables[0] if len(renderables) == 1 else Group(*renderables)
+        )
+
 
 # Logging functions for operations and activity
 
 
 def log_db_operation(operation_name, start_time, success=True, result=None, error=None):
     """Logs database operations with visual formatting"""
+    if not _VERBOSE:
+        return
+
     elapsed = time.time() - start_time
 
     if success:
-        console.print(
+        lines = [
             f"[bold green]🗃️ DB OPERATION:[/] {operation_name} [dim]({elapsed:.3f}s)[/dim]"
-        )
+        ]
         if result:
-            preview = str(result)[:100]
-            if len(str(result)) > 100:
-                preview += "..."
-            console.print(f"[dim green]  └─ Result: {preview}[/dim]")
+            text = (
+                result
+                if isinstance(result, str)
+                else orjson.dumps(
+                    result, default=str, option=orjson.OPT_NON_STR_KEYS
+                ).decode()
+            )
+            preview = text[:100] + "..." if len(text) > 100 else text
+            lines.append(f"[dim green]  └─ Result: {preview}[/dim]")
     else:
-        console.print(
+        lines = [
             f"[bold red]❌ DB ERROR:[/] {operation_name} [dim]({elapsed:.3f}s)[/dim]"
-        )
+        ]
         if error:
-            console.print(f"[dim red]  └─ Error: {str(error)}[/dim]")
+            lines.append(f"[dim red]  └─ Error: {str(error)}[/dim]")
+
+    _enqueue_log(*lines)
 
 
 def log_agent_activity(context, agent_name, activity_type, details=None):
     """Logs and visualizes agent activity in the system"""
-    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-
-    styles = {
-        "started": {"icon": "▶️", "color": "blue"},
-        "thinking": {"icon": "💭", "color": "yellow"},
-        "action": {"icon": "⚙️", "color": "cyan"},
-        "completed": {"icon": "✅", "color": "green"},
-        "error": {"icon": "❌", "color": "red"},
+    now = time.time()
+    timestamp = (
+        f"{time.strftime('%H:%M:%S', time.localtime(now))}.{int(now % 1 * 1000):03d}"
+    )
+    entry = {
+        "timestamp": timestamp,
+        "agent": agent_name,
+        "type": activity_type,
+        "details": details,
     }
+    # The context's own record is kept whatever the console verbosity
+    if isinstance(getattr(context, "activity_log", None), (list, deque)):
+        context.activity_log.append(entry)
 
-    style = styles.get(activity_type, {"icon": "ℹ️", "color": "white"})
+    if not _VERBOSE:
+        return
 
-    console.print(
-        f"[{style['color']}]{style['icon']} {timestamp} | {agent_name}[/{style['color']}]: ",
-        end="",
+    icon, color = ACTIVITY_STYLES.get(activity_type, DEFAULT_ACTIVITY_STYLE)
+    template = _ACTIVITY_MESSAGES.get(activity_type)
+    message = (
+        template.format(color=color, details=details) if template else f"{details}"
     )
-
-    if activity_type == "started":
-        console.print(f"[bold {style['color']}]Starting processing[/]")
-    elif activity_type == "thinking":
-        console.print(f"[italic {style['color']}]Analyzing '{details}'[/]")
-    elif activity_type == "action":
-        console.print(f"[bold {style['color']}]Executing {details}[/]")
-    elif activity_type == "completed":
-        console.print(f"[bold {style['color']}]Processing completed[/]")
-    elif activity_type == "error":
-        console.print(f"[bold {style['color']}]Error: {details}[/]")
-    else:
-        console.print(f"{details}")
-
-    if hasattr(context, "activity_log") and isinstance(context.activity_log, list):
-        context.activity_log.append(
-            {
-                "timestamp": timestamp,
-                "agent": agent_name,
-                "type": activity_type,
-                "details": details,
-            }
-        )
+    _enqueue_log(f"[{color}]{icon} {timestamp} | {agent_name}[/{color}]: {message}")
 
 
 HANDOFF_PROMPT_PREFIX = """
@@ -105,115 +174,13 @@ When you need specialized help, you can transfer the conversation to another age
 Available specialist agents:
 - ProductAgent: Searches and validates product information
 - SalesAgent: Generates payment links and processes orders
+- ReportsAgent: Builds sales reports for a date range
 
 To transfer, use the appropriate transfer tool when the user's request requires specialized knowledge.
 """
 
-
-@dataclass
-class OrderItem:
-    producto: str
-    cantidad: int
-    precio_unitario: Optional[float] = None
-
-
-@dataclass
-class ChatContext:
-    uid: str = field(default_factory=lambda: str(uuid.uuid4()))
-    messages: List[Dict[str, Any]] = field(default_factory=list)
-    current_order: Dict[str, OrderItem] = field(default_factory=dict)
-
-    def add_message(self, role: str, content: str) -> None:
-        self.messages.append({"role": role, "content": content})
-
-    def get_messages(self) -> List[Dict[str, Any]]:
-        return self.messages
-
-
-class HandoffData(BaseModel):
-    """Information for transfers between agents"""
-
-    prompt: str
-    context_data: Optional[Dict[str, Any]] = None
-    to_agent: Optional[str] = None  # Add target agent name
-
-    class Config:
-        arbitrary_types_allowed = True
-
-
-async def on_handoff(
-    ctx: RunContextWrapper[ChatContext], input_data: HandoffData
-) -> None:
-    """Function to log handoffs between agents with enhanced visualization"""
-    from_agent = (
-        getattr(ctx.agent, "name", "Unknown") if hasattr(ctx, "agent") else "Unknown"
-    )
-    to_agent = (
-        getattr(input_data, "to_agent", "Unknown")
-        if hasattr(input_data, "to_agent")
-        else "Target Agent"
-    )
-
-    agent_styles = {
-        "Main Agent": {"icon": "🧠", "color": "bold cyan"},
-        "Product Agent": {"icon": "🔍", "color": "bold green"},
-        "Sales Agent": {"icon": "💰", "color": "bold yellow"},
-    }
-
-    from_style = agent_styles.get(from_agent, {"icon": "👤", "color": "bold white"})
-    to_style = agent_styles.get(to_agent, {"icon": "👤", "color": "bold white"})
-
-    console.print("\n" + "─" * 80 + "\n")
-
-    console.print(
-        f"[{from_style['color']}]{from_style['icon']} {from_agent}[/] [bold magenta]→ TRANSFERRING TO →[/] [{to_style['color']}]{to_style['icon']} {to_agent}[/]"
-    )
-
-    if hasattr(input_data, "prompt") and input_data.prompt:
-        console.print(
-            Panel(
-                input_data.prompt,
-                title="💬 Message Sent",
-                border_style="blue",
-                expand=False,
-            )
-        )
-
-    if hasattr(input_data, "context_data") and input_data.context_data:
-        console.print(
-            Panel(
-                json.dumps(input_data.context_data, indent=2, ensure_ascii=False),
-                title="📋 Context Data",
-                border_style="green",
-                expand=False,
-            )
-        )
-
-    if (
-        hasattr(ctx, "context")
-        and hasattr(ctx.context, "current_order")
-        and ctx.context.current_order
-    ):
-        console.print(
-            Panel(
-                "\n".join(
-                    [
-                        f"{k}: {v.cantidad}x ${v.precio_unitario}"
-                        for k, v in ctx.context.current_order.items()
-                    ]
-                ),
-                title="🛒 Current Order",
-                border_style="yellow",
-                expand=False,
-            )
-        )
-
-
-class Agents:
-    def __init__(self) -> None:
-        self.productsagent = Agent(
-            name="Product Agent",
-            instructions="""You are an expert product finder who speaks with an enthusiastic and detail-oriented personality.
+PRODUCT_AGENT_INSTRUCTIONS = inspect.cleandoc(
+    """You are an expert product finder who speaks with an enthusiastic and detail-oriented personality.
 
     ALWAYS COMMUNICATE WITH THIS PERSONALITY:
     - Enthusiastic about products ("Excellent choice!")
@@ -233,22 +200,15 @@ class Agents:
        - Exact matches first (e.g., "pizza muzzarella" = "pizza muzzarella")
        - Then partial matches (e.g., "muzza" matches "pizza muzzarella")
        - Then variations (e.g., "pizza de muzza" matches "pizza muzzarella")
-    3. When found, ALWAYS return in EXACT format:
-       "PRODUCT_INFO: [exact_db_name] | PRICE: $[exact_db_price] | DESC: [exact_db_description] | ID: [exact_db_id] | DB_MATCH: true"
-    4. If no match is found:
-       "NO_MATCH: Could not find a product matching [query]"
-    """,
-            tools=[get_products],
-            model="gpt-4.1",
-        )
-        self.products_handoff = handoff(
-            agent=self.productsagent,
-            on_handoff=on_handoff,
-            input_type=HandoffData,
-        )
-        self.salesagent = Agent(
-            name="Sales Agent",
-            instructions="""You are a professional payment processor who speaks with a helpful and confident personality.
+    3. When found, return the EXACT database values: name, price, description, id
+       and db_match = true
+    4. If no match is found, return db_match = false with the customer's query as
+       the name, price 0, and empty description and id
+    """
+)
+
+SALES_AGENT_INSTRUCTIONS = inspect.cleandoc(
+    """You are a professional payment processor who speaks with a helpful and confident personality.
 
     ALWAYS COMMUNICATE WITH THIS PERSONALITY:
     - Helpful and attentive ("I'm processing your payment")
@@ -257,56 +217,37 @@ class Agents:
     - Occasionally use relevant emojis like 💰, 💳, 🔒
 
     MAIN RESPONSIBILITIES:
-    1. FIRST ACTION: Call create_mercadopago_link with the exact order amount
+    1. FIRST ACTION: Call prepare_payment with the exact order amount and products
     2. Return payment information in structured format
     3. NEVER modify order totals
     4. ALWAYS include the payment link in the response
-    5. ALWAYS register the purchase in the database
 
     WORKFLOW:
-    1. Receive the total order amount from the Main Agent
-    2. IMMEDIATELY call create_mercadopago_link with:
+    1. Receive the total order amount and the validated products from the Main Agent
+    2. IMMEDIATELY call prepare_payment with:
        - amount: Exact order amount
-       - title: "Order #[timestamp]"
-       - description: "Food order"
-    3. Get the payment type ID for "Mercado Pago" using get_purchase_types()
-       - Look for the ID where name is "Mercado Pago" or the closest match
-    4. Register the purchase in the database by calling create_purchase with:
-       - amount: Exact order amount
-       - purchase_type_id: ID of the "Mercado Pago" payment type
-       - products: List of product IDs with quantities
-    5. ALWAYS return in EXACT format:
+       - products: List of product IDs with quantities and unit prices
+    3. prepare_payment generates the Mercado Pago link, finds the "Mercado Pago"
+       payment type and registers the purchase in the database in a single step
+    4. ALWAYS return the total, link and order_id from the PAYMENT_INFO line of
+       prepare_payment EXACTLY as received:
        "PAYMENT_INFO: Total: $[amount] | Link: [mercadopago_link] | Order_ID: [timestamp]"
 
     TECHNICAL DETAILS:
-    1. The create_purchase function expects these EXACT fields:
+    1. The prepare_payment function expects these EXACT fields:
        - amount: float (total amount)
-       - purchase_type_id: string (UUID of payment type)
        - products: array of objects with:
          * product_id: string (UUID of product)
          * quantity: integer (quantity)
          * unit_price: float (unit price)
-    2. When the payment type ID for "Mercado Pago" is not found, use any available ID
-       OR return an error message but STILL include the payment link
-    """,
-            tools=[
-                create_mercadopago_link,
-                create_purchase,
-                get_purchase_types,
-                generate_sales_report,
-            ],
-            model="gpt-4.1",
-        )
-        self.sales_handoff = handoff(
-            agent=self.salesagent,
-            on_handoff=on_handoff,
-            input_type=HandoffData,
-        )
-        self.mainagent = Agent(
-            name="Main Agent",
-            instructions=f"""
-            {HANDOFF_PROMPT_PREFIX}
+    2. If prepare_payment reports "Error creating purchase:", return that line as
+       purchase_error but STILL include the payment link
+    """
+)
 
+# Composed once at import time; the prefix is shared rather than interpolated.
+# cleandoc strips the source indentation so it is not sent with every request
+MAIN_AGENT_INSTRUCTIONS = HANDOFF_PROMPT_PREFIX + "\n" + inspect.cleandoc("""
             You are the main coordinator who handles all customer interactions with a friendly and attentive personality.
 
             ALWAYS COMMUNICATE WITH THIS PERSONALITY:
@@ -316,24 +257,26 @@ class Agents:
             - Use relevant emojis like 🍕, 👋, 😊, ✅
 
             PROCEDURE FOR CALLING OTHER AGENTS:
-            - When the customer mentions a product: "Let me check that product..." → call Product Agent
+            - When the customer mentions a product: "Let me check that product..." → call find_product
             - When they confirm the order: "I'll process your payment..." → call Sales Agent
             - Always communicate the process: "I'm verifying / processing / checking..."
 
             MAIN RESPONSIBILITIES:
             1. Understand customer food orders in natural language
-            2. Consult the Product Agent for precise product details
+            2. Look up precise product details with find_product
             3. Maintain the current order state (products, prices, totals)
             4. Coordinate with the Sales Agent to generate payment links
 
             WORKFLOW WITH OTHER AGENTS:
-            - When customers mention a food item (like "pizza"), ALWAYS delegate first to the Product Agent
+            - When customers mention a food item (like "pizza"), ALWAYS call find_product first
+            - Only hand off to the Product Agent when find_product returns NO_MATCH for a loosely worded item; it resolves ONE product, so never use it to list the catalog
+            - When the customer asks to see everything, point them to the product list sent at the start of the chat
             - When the customer confirms the order, delegate to the Sales Agent to create the payment link
-            - You must follow the proper sequence: Product Agent → confirm order → Sales Agent
+            - You must follow the proper sequence: find_product → confirm order → Sales Agent
 
             PRODUCT SEARCH PROCESS:
-            1. When the customer mentions food items, immediately call the Product Agent
-            2. The Product Agent will search the database and respond in this format:
+            1. When the customer mentions food items, immediately call find_product with the item as the customer wrote it
+            2. find_product searches the database and responds in this format:
             "PRODUCT_INFO: [name] | PRICE: $[price] | DESC: [desc] | ID: [id] | DB_MATCH: true"
             OR "NO_MATCH: Could not find a product matching [query]"
             3. For successful matches, extract and store:
@@ -352,7 +295,7 @@ class Agents:
 
             PAYMENT PROCESS:
             1. When the customer confirms the order, calculate the total amount
-            2. Delegate to the Sales Agent with the verified total amount
+            2. Delegate to the Sales Agent with the verified total amount and the products (IDs, quantities, unit prices)
             3. The Sales Agent will respond with:
             "PAYMENT_INFO: Total: $[amount] | Link: [link] | Order_ID: [id]"
             4. Extract the payment link and present it to the customer
@@ -366,13 +309,13 @@ class Agents:
 
             INTERACTION EXAMPLES:
             Customer: "I want a muzzarella pizza"
-            You: → Call the Product Agent
-            Product Agent: "PRODUCT_INFO: Pizza muzzarella | PRICE: $10.00 | DESC: Pizza with muzzarella cheese | ID: b301e81a-6d3e-4d4d-ab4e-28e88002c10e | DB_MATCH: true"
+            You: → Call find_product
+            find_product: "PRODUCT_INFO: Pizza muzzarella | PRICE: $10.00 | DESC: Pizza with muzzarella cheese | ID: b301e81a-6d3e-4d4d-ab4e-28e88002c10e | DB_MATCH: true"
             You: "Perfect! 🍕 I've added a Pizza muzzarella to your order for $10.00. Would you like to order anything else or proceed with payment?"
 
             Customer: "I want to add a soda"
-            You: → Call the Product Agent
-            Product Agent: "PRODUCT_INFO: Coca-Cola 500ml | PRICE: $3.50 | DESC: Carbonated beverage | ID: d45e81a-9f3e-8d9d-cd4e-12e88042a45e | DB_MATCH: true"
+            You: → Call find_product
+            find_product: "PRODUCT_INFO: Coca-Cola 500ml | PRICE: $3.50 | DESC: Carbonated beverage | ID: d45e81a-9f3e-8d9d-cd4e-12e88042a45e | DB_MATCH: true"
             You: "Excellent! I've added a Coca-Cola 500ml for $3.50 to your order. Your current total is $13.50. Anything else or shall we proceed to payment?"
 
             Customer: "That's all, I want to pay"
@@ -384,7 +327,7 @@ class Agents:
 
             ERROR HANDLING:
             - If product not found: Ask the customer for alternative options or clarifications
-            - If price not confirmed: Retry with the Product Agent, never proceed with unconfirmed prices
+            - If price not confirmed: Retry with find_product, never proceed with unconfirmed prices
             - If payment link fails: Inform the customer and retry with the Sales Agent
             - Always show specific error details to help the customer understand the problem
 
@@ -396,118 +339,494 @@ class Agents:
 
             PAYMENT LINK RULE:
             - Only generate a payment link ONCE per order. If a payment link has already been generated (context.payment_generated is True), do NOT call the Sales Agent again. Instead, simply resend the existing payment link from context.payment_link if the user requests it again.
-            """,
+            """)
+
+REPORTS_AGENT_INSTRUCTIONS = inspect.cleandoc(
+    """You are a sales analyst who prepares clear and accurate sales reports.
+
+    MAIN RESPONSIBILITIES:
+    1. Call generate_sales_report with the requested period (ISO dates: YYYY-MM-DD)
+    2. Present total sales, number of purchases and average purchase exactly as returned
+    3. NEVER invent or estimate figures
+    """
+)
+
+SUMMARY_AGENT_INSTRUCTIONS = inspect.cleandoc(
+    """Summarize the conversation between a customer and a food ordering assistant.
+    Keep every product, quantity, price, product ID, payment link and order number mentioned.
+    Keep the customer's language and preferences. Reply with the summary only, in a few sentences.
+    """
+)
+
+# Customer-facing templates for humanized PRODUCT_INFO / PAYMENT_INFO responses
+_PRODUCT_TEMPLATE = (
+    "Excellent choice! 🍕 I've added {name} for {price} to your order. "
+    "Would you like to add anything else or proceed to payment?"
+)
+_PAYMENT_TEMPLATE = (
+    "Your order is ready to pay! 👍\n\n💰 Total to pay: {total}\n\n"
+    "🔗 Payment link: {link}\n\n🧾 Order number: {order_id}{error_message}\n\n"
+    "Is there anything else I can help you with?"
+)
+_PURCHASE_ERROR_NOTE = (
+    "\n\n⚠️ Note: There was a small technical issue when registering your "
+    "purchase in our database, but don't worry. Your payment and order will be "
+    "processed correctly."
+)
+
+# Single-pass parsers for the structured PRODUCT_INFO / PAYMENT_INFO lines
+PRODUCT_INFO_RE = re.compile(
+    r"PRODUCT_INFO:\s*(?P<name>[^|\n]+?)\s*\|\s*PRICE:\s*(?P<price>[^|\n]+?)\s*(?:\||$)",
+    re.MULTILINE,
+)
+PAYMENT_INFO_RE = re.compile(
+    r"PAYMENT_INFO:\s*Total:\s*(?P<total>[^|\n]+?)\s*\|\s*Link:\s*(?P<link>[^|\s]+)"
+    r"(?:\s*\|\s*Order_ID:\s*(?P<order_id>[^|\n]+?))?\s*(?:\||$)",
+    re.MULTILINE,
+)
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _decode_json_after(text: str, marker: str) -> Any:
+    """Decodes the JSON value that follows *marker*, ignoring any trailing text"""
+    start = text.index(marker) + len(marker)
+    value, _ = _JSON_DECODER.raw_decode(text[start:].lstrip())
+    return value
+
+
+def _humanize_text_response(response: str) -> str:
+    """Renders PRODUCT_INFO / PAYMENT_INFO lines found in a plain-text response"""
+    # Most replies are plain prose: one scan for the shared suffix rules out both
+    if "_INFO:" not in response:
+        return ""
+    has_product = "PRODUCT_INFO:" in response
+    has_payment = "PAYMENT_INFO:" in response
+    if not (has_product or has_payment):
+        return ""
+
+    humanized_output = ""
+    if has_product:
+        product_match = PRODUCT_INFO_RE.search(response)
+        if product_match:
+            humanized_output = _PRODUCT_TEMPLATE.format_map(product_match.groupdict())
+        else:
+            try:
+                products_data = _decode_json_after(response, "PRODUCT_INFO:")
+                lines = ["📋 Selected products:"]
+                lines.extend(f"- {p['name']}: ${p['price']}" for p in products_data)
+                humanized_output = "\n".join(lines) + "\n\n"
+            except Exception:
+                pass
+
+    if has_payment:
+        payment_match = PAYMENT_INFO_RE.search(response)
+        if payment_match:
+            return _PAYMENT_TEMPLATE.format_map(
+                {
+                    "total": payment_match["total"],
+                    "link": payment_match["link"],
+                    "order_id": payment_match["order_id"] or "",
+                    "error_message": (
+                        _PURCHASE_ERROR_NOTE
+                        if "Error creating purchase:" in response
+                        else ""
+                    ),
+                }
+            )
+        try:
+            payment_data = _decode_json_after(response, "PAYMENT_INFO:")
+            humanized_output += (
+                "💰 Payment information:\n"
+                f"- Total: ${payment_data.get('total', 'N/A')}\n"
+                f"- Payment link: {payment_data.get('payment_link', 'N/A')}\n"
+                f"- Order ID: {payment_data.get('order_id', 'N/A')}\n"
+            )
+        except Exception:
+            pass
+
+    return humanized_output
+
+
+@dataclass
+class OrderItem:
+    producto: str
+    cantidad: int
+    precio_unitario: Optional[float] = None
+
+
+ACTIVITY_LOG_MAXLEN = 500
+# After a failed history summary, wait this long before retrying (doubling on
+# each further failure, up to the max)
+COMPACTION_RETRY_BASE = 30  # seconds
+COMPACTION_RETRY_MAX = 600  # seconds
+
+
+@dataclass
+class ChatContext:
+    # External session ID (e.g. WhatsApp wa_id); generated lazily by get_uid()
+    uid: Optional[str] = None
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    # Once history passes 2 * history_window, the older turns are folded into
+    # `summary` in the background; `messages` keeps everything not yet
+    # summarized, and all of it is sent to the agents
+    summary: str = ""
+    history_window: int = 8
+    current_order: Dict[str, OrderItem] = field(default_factory=dict)
+    # Recent agent activity; the oldest entries are dropped past the cap
+    activity_log: Deque[Dict[str, Any]] = field(
+        default_factory=lambda: deque(maxlen=ACTIVITY_LOG_MAXLEN)
+    )
+    # Agent the current run started from, shown as the source of handoffs
+    current_agent: str = MAIN_AGENT_NAME
+    # Background compaction state: one summary at a time, backoff on failure
+    _compacting: bool = field(default=False, init=False, repr=False, compare=False)
+    _compaction_failures: int = field(default=0, init=False, repr=False, compare=False)
+    _next_compaction_at: float = field(
+        default=0.0, init=False, repr=False, compare=False
+    )
+
+    def get_uid(self) -> str:
+        if self.uid is None:
+            self.uid = str(uuid.uuid4())
+        return self.uid
+
+    def add_message(self, role: str, content: str) -> None:
+        self.messages.append({"role": role, "content": content})
+
+    def get_messages(self) -> List[Dict[str, Any]]:
+        return self.messages
+
+    def get_messages_for_agent(self) -> List[Dict[str, Any]]:
+        """Returns the running summary plus every message not yet summarized"""
+        if not self.summary:
+            return list(self.messages)
+        return [
+            {"role": "system", "content": f"Conversation so far: {self.summary}"},
+            *self.messages,
+        ]
+
+    def compact(self, summary: str, count: int) -> None:
+        """Replaces the oldest *count* messages with *summary*"""
+        self.summary = summary
+        del self.messages[:count]
+        self._compacting = False
+        self._compaction_failures = 0
+
+    def needs_compaction(self) -> bool:
+        return (
+            not self._compacting
+            and len(self.messages) > 2 * self.history_window
+            and time.monotonic() >= self._next_compaction_at
+        )
+
+    def begin_compaction(self) -> None:
+        self._compacting = True
+
+    def compaction_failed(self) -> None:
+        """Keeps the raw messages and schedules the next attempt with backoff"""
+        self._compacting = False
+        self._compaction_failures += 1
+        delay = COMPACTION_RETRY_BASE * 2 ** (self._compaction_failures - 1)
+        self._next_compaction_at = time.monotonic() + min(delay, COMPACTION_RETRY_MAX)
+
+
+class _DictContextAdapter:
+    """Message access for plain ``{"messages": [...]}`` contexts"""
+
+    @staticmethod
+    def add_message(context: Dict[str, Any], role: str, content: str) -> None:
+        context["messages"].append({"role": role, "content": content})
+
+    @staticmethod
+    def get_messages(context: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return context["messages"]
+
+    @staticmethod
+    def get_agent_input(context: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return context["messages"]
+
+
+class _ChatContextAdapter:
+    """Message access for ChatContext-like objects"""
+
+    @staticmethod
+    def add_message(context: ChatContext, role: str, content: str) -> None:
+        context.add_message(role, content)
+
+    @staticmethod
+    def get_messages(context: ChatContext) -> List[Dict[str, Any]]:
+        return context.get_messages()
+
+    @staticmethod
+    def get_agent_input(context: ChatContext) -> List[Dict[str, Any]]:
+        return context.get_messages_for_agent()
+
+
+_DICT_ADAPTER = _DictContextAdapter()
+_CHAT_CONTEXT_ADAPTER = _ChatContextAdapter()
+
+
+class ProductInfo(BaseModel):
+    """Structured Product Agent result"""
+
+    name: str
+    price: float
+    description: str
+    id: str
+    db_match: bool
+
+    def to_line(self) -> str:
+        if not self.db_match:
+            return f"NO_MATCH: Could not find a product matching {self.name}"
+        return (
+            f"PRODUCT_INFO: {self.name} | PRICE: ${self.price:.2f} | "
+            f"DESC: {self.description} | ID: {self.id} | DB_MATCH: true"
+        )
+
+
+class PaymentInfo(BaseModel):
+    """Structured Sales Agent result"""
+
+    total: float
+    link: str
+    order_id: str
+    purchase_error: Optional[str] = None
+
+    def to_line(self) -> str:
+        line = f"PAYMENT_INFO: Total: ${self.total:.2f} | Link: {self.link} | Order_ID: {self.order_id}"
+        if self.purchase_error:
+            return f"{line}\n{self.purchase_error}"
+        return line
+
+
+class HandoffData(BaseModel):
+    """Information for transfers between agents"""
+
+    prompt: str
+    context_data: Optional[Dict[str, Any]] = None
+    to_agent: Optional[str] = None  # Add target agent name
+
+    # Only the SDK builds HandoffData (from the model's tool-call JSON); its
+    # validator is compiled on that first use rather than at import. Handoff
+    # payloads are read-only, so they are frozen and never copied on nesting
+    model_config = ConfigDict(
+        arbitrary_types_allowed=True,
+        defer_build=True,
+        copy_on_model_validation="none",
+        frozen=True,
+    )
+
+
+async def on_handoff(
+    ctx: RunContextWrapper[ChatContext], input_data: HandoffData
+) -> None:
+    """Function to log handoffs between agents with enhanced visualization"""
+    if not _VERBOSE:
+        return
+
+    context = ctx.context
+    try:
+        from_agent = context.current_agent
+        order = context.current_order
+    except AttributeError:  # plain dict contexts carry no agent or order
+        from_agent, order = "Unknown", None
+    to_agent = input_data.to_agent or "Target Agent"
+
+    from_style = AGENT_STYLES.get(from_agent, DEFAULT_AGENT_STYLE)
+    to_style = AGENT_STYLES.get(to_agent, DEFAULT_AGENT_STYLE)
+
+    # Collect everything into one Group so Rich lays it out and writes it once
+    renderables = [
+        "\n" + "─" * 80 + "\n",
+        f"[{from_style['color']}]{from_style['icon']} {from_agent}[/] [bold magenta]→ TRANSFERRING TO →[/] [{to_style['color']}]{to_style['icon']} {to_agent}[/]",
+    ]
+
+    if input_data.prompt:
+        renderables.append(
+            Panel(
+                input_data.prompt,
+                title="💬 Message Sent",
+                border_style="blue",
+                expand=False,
+            )
+        )
+
+    if input_data.context_data:
+        renderables.append(
+            Panel(
+                orjson.dumps(
+                    input_data.context_data,
+                    option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS,
+                ).decode(),
+                title="📋 Context Data",
+                border_style="green",
+                expand=False,
+            )
+        )
+
+    if order:
+        renderables.append(
+            Panel(
+                "\n".join(
+                    f"{k}: {v.cantidad}x ${v.precio_unitario}" for k, v in order.items()
+                ),
+                title="🛒 Current Order",
+                border_style="yellow",
+                expand=False,
+            )
+        )
+
+    _enqueue_log(Group(*renderables))
+
+
+def _noop(event: Any) -> None:
+    pass
+
+
+# Trace event handlers keyed by event type; none of them print anything yet
+_TRACE_HANDLERS: Dict[str, Callable[[Any], None]] = {
+    "agent_started": _noop,
+    "agent_finished": _noop,
+    "tool_started": _noop,
+    "tool_finished": _noop,
+    "handoff_started": _noop,
+}
+
+
+def _cached_prompt_settings(agent_name: str) -> ModelSettings:
+    """Keys OpenAI prompt caching per agent; instructions are static constants"""
+    return ModelSettings(extra_body={"prompt_cache_key": f"agent:{agent_name}"})
+
+
+class Agents:
+    def __init__(self) -> None:
+        self.productsagent = Agent(
+            name=PRODUCT_AGENT_NAME,
+            instructions=PRODUCT_AGENT_INSTRUCTIONS,
+            tools=[get_products],
+            model=PRODUCT_AGENT_MODEL,
+            model_settings=_cached_prompt_settings(PRODUCT_AGENT_NAME),
+            output_type=ProductInfo,
+        )
+        self.products_handoff = handoff(
+            agent=self.productsagent,
+            on_handoff=on_handoff,
+            input_type=HandoffData,
+        )
+        self.salesagent = Agent(
+            name=SALES_AGENT_NAME,
+            instructions=SALES_AGENT_INSTRUCTIONS,
+            tools=[prepare_payment],
             model="gpt-4.1",
-            handoffs=[self.salesagent, self.productsagent],
+            model_settings=_cached_prompt_settings(SALES_AGENT_NAME),
+            output_type=PaymentInfo,
+        )
+        self.sales_handoff = handoff(
+            agent=self.salesagent,
+            on_handoff=on_handoff,
+            input_type=HandoffData,
+        )
+        # Reporting lives on its own agent so its tool schema is not sent with
+        # every payment request
+        self.reportsagent = Agent(
+            name=REPORTS_AGENT_NAME,
+            instructions=REPORTS_AGENT_INSTRUCTIONS,
+            tools=[generate_sales_report],
+            model="gpt-4.1",
+            model_settings=_cached_prompt_settings(REPORTS_AGENT_NAME),
+        )
+        self.reports_handoff = handoff(
+            agent=self.reportsagent,
+            on_handoff=on_handoff,
+            input_type=HandoffData,
+        )
+        self.mainagent = Agent(
+            name=MAIN_AGENT_NAME,
+            instructions=MAIN_AGENT_INSTRUCTIONS,
+            model="gpt-4.1",
+            model_settings=_cached_prompt_settings(MAIN_AGENT_NAME),
+            tools=[find_product],
+            handoffs=[self.sales_handoff, self.products_handoff, self.reports_handoff],
+        )
+        self.summaryagent = Agent(
+            name="Summary Agent",
+            instructions=SUMMARY_AGENT_INSTRUCTIONS,
+            model="gpt-4.1-mini",
+            model_settings=_cached_prompt_settings("Summary Agent"),
         )
         self.current_conversations = []
         self.conversation_history = []
+        # Strong references to fire-and-forget tasks so they are not collected
+        self._background_tasks: set = set()
 
     async def run(self, text, context=None):
         """Runs the agent with the provided text and returns its response"""
         if context is None:
             context = {"messages": []}
-            is_dict_context = True
+        adapter = _DICT_ADAPTER if isinstance(context, dict) else _CHAT_CONTEXT_ADAPTER
+
+        if adapter is _CHAT_CONTEXT_ADAPTER:
+            context.current_agent = self.mainagent.name
+
+        # The user message is recorded together with the reply, so a turn that
+        # fails or is cancelled on timeout leaves the history untouched
+        if adapter.get_messages(context):
+            agent_input = [
+                *adapter.get_agent_input(context),
+                {"role": "user", "content": text},
+            ]
         else:
-            is_dict_context = not hasattr(context, "add_message")
+            agent_input = text
 
-        if is_dict_context:
-            context["messages"].append({"role": "user", "content": text})
-            message_count = len(context["messages"])
-        else:
-            context.add_message("user", text)
-            message_count = len(context.get_messages())
+        result = await Runner.run(
+            starting_agent=self.mainagent,
+            input=agent_input,
+            context=context,
+        )
 
-        if message_count == 1:
-            result = await Runner.run(
-                starting_agent=self.mainagent, input=text, context=context
-            )
-        else:
-            if is_dict_context:
-                agent_context = {"messages": context["messages"]}
-            else:
-                agent_context = context.get_messages()
+        output = result.final_output if hasattr(result, "final_output") else str(result)
+        humanized_output = ""
 
-            result = await Runner.run(
-                starting_agent=self.mainagent, input=agent_context, context=context
+        # Structured outputs from the Product / Sales agents are rendered to
+        # their canonical text line, which is what gets stored and returned
+        if isinstance(output, PaymentInfo):
+            response = output.to_line()
+            humanized_output = _PAYMENT_TEMPLATE.format_map(
+                {
+                    "total": f"${output.total:.2f}",
+                    "link": output.link,
+                    "order_id": output.order_id,
+                    "error_message": (
+                        _PURCHASE_ERROR_NOTE if output.purchase_error else ""
+                    ),
+                }
             )
+        elif isinstance(output, ProductInfo):
+            response = output.to_line()
+            if output.db_match:
+                humanized_output = _PRODUCT_TEMPLATE.format_map(
+                    {"name": output.name, "price": f"${output.price:.2f}"}
+                )
+        else:
+            response = output
+            if isinstance(response, str):
+                humanized_output = _humanize_text_response(response)
 
-        response = (
-            result.final_output if hasattr(result, "final_output") else str(result)
+        _enqueue_log(
+            "\n[bold green]FINAL RESPONSE:[/]", humanized_output or str(response)
         )
-        final_output = response
-        humanized_output = ""
 
-        if isinstance(response, str) and (
-            "PRODUCT_INFO:" in response or "PAYMENT_INFO:" in response
-        ):
-            if "PRODUCT_INFO:" in response:
-                try:
-                    if "|" in response:
-                        product_parts = response.split("|")
-                        product_name = (
-                            product_parts[0].replace("PRODUCT_INFO:", "").strip()
-                        )
-                        price = product_parts[1].replace("PRICE:", "").strip()
-                        humanized_output = f"Excellent choice! 🍕 I've added {product_name} for {price} to your order. Would you like to add anything else or proceed to payment?"
-                    else:
-                        products_info = (
-                            response.split("PRODUCT_INFO:")[1].split("\n")[0].strip()
-                        )
-                        products_data = json.loads(products_info)
-                        humanized_output += "📋 Selected products:\n"
-                        for product in products_data:
-                            humanized_output += (
-                                f"- {product['name']}: ${product['price']}\n"
-                            )
-                        humanized_output += "\n"
-                except Exception:
-                    pass
-
-            if "PAYMENT_INFO:" in response:
-                try:
-                    if "|" in response:
-                        payment_parts = response.split("|")
-                        total = (
-                            payment_parts[0].replace("PAYMENT_INFO: Total:", "").strip()
-                        )
-                        link = payment_parts[1].replace("Link:", "").strip()
-                        order_id = (
-                            payment_parts[2].replace("Order_ID:", "").strip()
-                            if len(payment_parts) > 2
-                            else ""
-                        )
-
-                        error_message = ""
-                        if "Error creating purchase:" in response:
-                            error_message = "\n\n⚠️ Note: There was a small technical issue when registering your purchase in our database, but don't worry. Your payment and order will be processed correctly."
-
-                        humanized_output = f"Your order is ready to pay! 👍\n\n💰 Total to pay: {total}\n\n🔗 Payment link: {link}\n\n🧾 Order number: {order_id}{error_message}\n\nIs there anything else I can help you with?"
-                    else:
-                        payment_info = response.split("PAYMENT_INFO:")[1].strip()
-                        payment_data = json.loads(payment_info)
-                        humanized_output += "💰 Payment information:\n"
-                        humanized_output += (
-                            f"- Total: ${payment_data.get('total', 'N/A')}\n"
-                        )
-                        humanized_output += f"- Payment link: {payment_data.get('payment_link', 'N/A')}\n"
-                        humanized_output += (
-                            f"- Order ID: {payment_data.get('order_id', 'N/A')}\n"
-                        )
-                except Exception:
-                    pass
-
-        if humanized_output:
-            console.print("\n[bold green]FINAL RESPONSE:[/]")
-            console.print(humanized_output)
-        else:
-            console.print("\n[bold green]FINAL RESPONSE:[/]")
-            console.print(response)
+        adapter.add_message(context, "user", text)
+        adapter.add_message(context, "assistant", response)
 
-        if is_dict_context:
-            context["messages"].append({"role": "assistant", "content": response})
-        else:
-            context.add_message("assistant", response)
+        # Summarizing old turns is an extra LLM call; run it after the reply
+        # instead of making the customer wait for it
+        if isinstance(context, ChatContext) and context.needs_compaction():
+            context.begin_compaction()
+            task = asyncio.create_task(self._compact_history(context))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
 
         # Guardrail: If payment already generated, block duplicate payment link generation
         if hasattr(context, "payment_generated") and context.payment_generated:
@@ -526,47 +845,39 @@ class Agents:
 
         return response
 
+    async def _compact_history(self, context: ChatContext) -> None:
+        """Folds the messages older than the history window into context.summary"""
+        oldest = context.messages[: -context.history_window]
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in oldest)
+        if context.summary:
+            transcript = f"Previous summary: {context.summary}\n\n{transcript}"
+
+        try:
+            result = await Runner.run(
+                starting_agent=self.summaryagent, input=transcript
+            )
+        except asyncio.CancelledError:
+            context.compaction_failed()
+            raise
+        except Exception as e:
+            if _VERBOSE:
+                _enqueue_log(f"[dim red]Error summarizing history: {str(e)}[/dim red]")
+            context.compaction_failed()
+            return
+
+        context.compact(str(result.final_output), len(oldest))
+
     def _trace_callback(self, event):
         """Callback to display events during execution"""
         if isinstance(event, dict):
             event_type = event.get("type")
-
-            if event_type == "agent_started":
-                agent_name = event.get("agent", {}).get("name", "Unknown")
-                pass
-
-            elif event_type == "agent_finished":
-                agent_name = event.get("agent", {}).get("name", "Unknown")
-                pass
-
-            elif event_type == "tool_started":
-                tool_name = event.get("tool_name", "Unknown")
-                pass
-
-            elif event_type == "tool_finished":
-                tool_name = event.get("tool_name", "Unknown")
-                pass
-
-            elif event_type == "handoff_started":
-                target_agent_name = event.get("target_agent", {}).get("name", "Unknown")
-                pass
         else:
-            # If not a dictionary, we try to handle it as an object
-            try:
-                if hasattr(event, "type"):
-                    if event.type == "agent_started":
-                        pass
-
-                    elif event.type == "agent_finished":
-                        pass
-
-                    elif event.type == "tool_started":
-                        pass
+            event_type = getattr(event, "type", None)
+        if event_type:
+            _TRACE_HANDLERS.get(event_type, _noop)(event)
 
-                    elif event.type == "tool_finished":
-                        pass
 
-                    elif event.type == "handoff_started":
-                        pass
-            except Exception as e:
-                console.print(f"[dim red]Error processing event: {str(e)}[/dim red]")
+@functools.cache
+def get_agents() -> Agents:
+    """Returns the process-wide Agents instance, building it on first use"""
+    return Agents()
@@ -1,12 +1,15 @@
-from typing import Any, Callable
-from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+import asyncio
+import difflib
+import queue
+import threading
 import time
 import traceback
+import unicodedata
 from .supabase_client import supabase
 from .models import (
-    Product,
-    Purchase,
-    PurchaseType,
     ProductInput,
     PurchaseInput,
     SalesReportInput,
@@ -14,19 +17,14 @@ from .models import (
 from rich.console import Console
 from agents import function_tool, RunContextWrapper
 from functools import wraps
-from pydantic import BaseModel
-import json
+from operator import itemgetter
+import orjson
+from ..flags import env_flag
 
 console = Console()
-
-
-# --- Pydantic Models for Function Parameters --- #
-class PurchaseProduct(BaseModel):
-    """Model for products in a purchase."""
-
-    product_id: str
-    quantity: int
-    unit_price: float
+# DB tracing follows DB_TRACE (see env_flag); when off, db_tracer and the
+# per-call progress lines add no formatting work. Errors are always printed
+DB_TRACE_ENABLED = env_flag("DB_TRACE")
 
 
 def db_tracer(func):
@@ -34,6 +32,9 @@ def db_tracer(func):
 
     @wraps(func)
     async def wrapper(*args, **kwargs):
+        if not DB_TRACE_ENABLED:
+            return await func(*args, **kwargs)
+
         operation_name = func.__name__
         start_time = time.time()
 
@@ -82,64 +83,349 @@ def auto_schema(name_override: str):
     """Decorator that automatically generates JSON schema for database functions."""
 
     def decorator(func: Callable):
-        @wraps(func)
-        @db_tracer  # Add database tracing decorator
-        async def wrapper(ctx: RunContextWrapper[Any], *args, **kwargs):
-            return await func(ctx, *args, **kwargs)
-
-        return function_tool(name_override=name_override)(wrapper)
+        # db_tracer already forwards every argument, so it is the only wrapper
+        return function_tool(name_override=name_override)(db_tracer(func))
 
     return decorator
 
 
+# --- Query Execution --- #
+# supabase-py is synchronous: every tool shares the one client (and its
+# keep-alive HTTP connection pool) and runs its queries on this bounded pool of
+# worker threads, so concurrent tool calls do not queue behind each other on the
+# event loop
+DB_MAX_WORKERS = 10
+_db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="db")
+
+
+async def _execute(query: Any) -> Any:
+    """Runs a PostgREST query builder's execute() on the DB worker pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, query.execute)
+
+
+# Supabase's PostgREST caps each response at max-rows (1000 by default), so
+# unbounded reads go page by page; a short page means there is nothing left
+DB_PAGE_SIZE = 1000
+
+
+async def _iter_pages(
+    build_query: Callable[[], Any],
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Yields the rows of build_query() one id-ordered page at a time.
+
+    Query builders accumulate params, so build_query must return a fresh one.
+    """
+    offset = 0
+    while True:
+        query = build_query().order("id").range(offset, offset + DB_PAGE_SIZE - 1)
+        rows = (await _execute(query)).data or []
+        if rows:
+            yield rows
+        if len(rows) < DB_PAGE_SIZE:
+            return
+        offset += DB_PAGE_SIZE
+
+
+# --- Lookup Caches --- #
+# The Product Agent fetches the catalog on every turn; serve it from memory briefly
+PRODUCTS_TTL = 60  # seconds
+# Payment types are close to static, so the Sales Agent reuses the last lookup
+PURCHASE_TYPES_TTL = 300  # seconds
+
+_products_cache: Optional[Tuple[float, List[Dict[str, Any]]]] = None
+_purchase_types_cache: Optional[Tuple[float, List[Dict[str, str]]]] = None
+
+
+# --- Purchase Batching --- #
+PURCHASE_BATCH_SIZE = 32
+
+
+class _PurchaseBatcher:
+    """Coalesces concurrent `compras` inserts into multi-row INSERTs.
+
+    A background thread takes every row queued so far (up to PURCHASE_BATCH_SIZE)
+    and inserts them in one round trip, so a lone order is written immediately
+    while bursts share requests. A thread is used instead of an asyncio task
+    because the insert is a blocking supabase-py call that must stay off the
+    agent event loop.
+    """
+
+    def __init__(self, max_batch: int = PURCHASE_BATCH_SIZE) -> None:
+        self._queue: "queue.SimpleQueue[Tuple[Dict[str, Any], Future]]" = (
+            queue.SimpleQueue()
+        )
+        self._max_batch = max_batch
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    async def submit(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Queues a purchase row and returns the inserted record."""
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((row, future))
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # The caller gave up (e.g. its turn timed out). A row still queued
+            # is skipped by _flush; one already being inserted is deleted again
+            # so no purchase is left without its line items
+            if not future.cancel():
+                future.add_done_callback(_discard_inserted_purchase)
+            raise
+
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="purchase-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._flush(batch)
+            except Exception as e:
+                # Never let one batch kill the worker: later orders would hang.
+                # Each order still reports the error through its future
+                if DB_TRACE_ENABLED:
+                    console.print(f"[bold red]❌ Purchase batch failed:[/] {str(e)}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _flush(self, batch: List[Tuple[Dict[str, Any], Future]]) -> None:
+        # Claim every future first: cancelled orders are dropped before their
+        # row is written, and claimed ones can no longer be cancelled
+        batch = [(row, f) for row, f in batch if f.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        try:
+            inserted = self._insert([row for row, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # One bad row fails the whole INSERT; retry the rows one by one so
+            # it only fails its own order
+            for row, future in batch:
+                try:
+                    record = self._insert([row])[0]
+                except Exception as row_error:
+                    future.set_exception(row_error)
+                else:
+                    future.set_result(record)
+            return
+
+        if DB_TRACE_ENABLED and len(batch) > 1:
+            console.print(f"[dim blue]  └─ Inserted {len(batch)} purchases[/dim blue]")
+        for (_, future), record in zip(batch, inserted):
+            future.set_result(record)
+
+    @staticmethod
+    def _insert(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        response = supabase.table("compras").insert(rows).execute()
+        inserted = response.data or []
+        if len(inserted) != len(rows):
+            raise RuntimeError("No response data received")
+        return inserted
+
+
+def _discard_inserted_purchase(future: Future) -> None:
+    """Deletes a purchase whose caller was cancelled while it was being inserted."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    purchase_id = future.result()["id"]
+    # Done callbacks may run on the event loop thread; keep the DELETE off it
+    _db_executor.submit(
+        supabase.table("compras").delete().eq("id", purchase_id).execute
+    )
+
+
+_purchase_batcher = _PurchaseBatcher()
+
+
+# --- Catalog Lookups --- #
+def invalidate_products_cache() -> None:
+    """Drops the cached catalog so the next lookup reads the table again."""
+    global _products_cache
+    _products_cache = None
+
+
+# Columns read from `productos`; every selected column is present in each row
+_PRODUCT_COLUMNS = ("nombre", "marca", "precio", "descripcion", "id")
+_get_product_columns = itemgetter(*_PRODUCT_COLUMNS)
+
+
+async def fetch_products() -> List[Dict[str, Any]]:
+    """Returns the product catalog as plain dicts, cached for PRODUCTS_TTL."""
+    global _products_cache
+
+    now = time.monotonic()
+    if _products_cache and now - _products_cache[0] < PRODUCTS_TTL:
+        if DB_TRACE_ENABLED:
+            console.print("[dim green]  └─ Products served from cache[/dim green]")
+        return _products_cache[1]
+
+    if DB_TRACE_ENABLED:
+        console.print("[bold blue]📊 Querying products table...[/bold blue]")
+    rows = [
+        row
+        async for page in _iter_pages(
+            lambda: supabase.table("productos").select(",".join(_PRODUCT_COLUMNS))
+        )
+        for row in page
+    ]
+
+    if not rows:
+        console.print("[bold yellow]⚠️ The query returned no data[/bold yellow]")
+        return []
+
+    # Map the Spanish columns straight to the English catalog fields
+    catalog = [
+        {
+            "name": name,
+            "brand": brand,
+            "price": float(price or 0),
+            "description": description,
+            "id": str(product_id),
+        }
+        for name, brand, price, description, product_id in map(
+            _get_product_columns, rows
+        )
+    ]
+
+    if DB_TRACE_ENABLED:
+        console.print(f"[bold green]✅ Found {len(catalog)} products[/bold green]")
+        for p in catalog[:3]:
+            console.print(f"[dim]  └─ {p['name']}: ${p['price']} (ID: {p['id']})[/dim]")
+        if len(catalog) > 3:
+            console.print(f"[dim]  └─ ... and {len(catalog) - 3} more[/dim]")
+
+    _products_cache = (now, catalog)
+    return catalog
+
+
+# --- Product Matching --- #
+def _normalize_product_text(text: str) -> str:
+    """Lowercases and strips accents so "Muzzarella" and "muzzarélla" compare equal."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return decomposed.encode("ascii", "ignore").decode("ascii").lower().strip()
+
+
+# Normalized names and match results are kept per catalog list: fetch_products
+# returns the same list while its cache is fresh, so a new list (a refetch)
+# starts over
+MATCH_CACHE_MAX = 256
+
+_match_cache: Tuple[
+    Optional[List[Dict[str, Any]]],
+    List[str],
+    Dict[str, Dict[str, Any]],
+    Dict[str, Optional[Dict[str, Any]]],
+] = (None, [], {}, {})
+
+
+def match_product(
+    query: str, products: List[Dict[str, Any]]
+) -> Optional[Dict[str, Any]]:
+    """Finds the catalog entry that best matches a customer's wording.
+
+    Tries an exact name match first, then names containing every meaningful
+    word of the query (e.g. "pizza de muzza" -> "Pizza muzzarella"), and
+    finally close spellings.
+    """
+    global _match_cache
+
+    normalized_query = _normalize_product_text(query)
+    if not normalized_query:
+        return None
+
+    catalog, names, by_name, memo = _match_cache
+    if catalog is not products:
+        # Each name is normalized once per catalog, not once per lookup, and
+        # indexed so exact matches are a dict hit (the first product wins)
+        names = [_normalize_product_text(p["name"] or "") for p in products]
+        by_name = {}
+        for name, p in zip(names, products):
+            by_name.setdefault(name, p)
+        memo = {}
+        _match_cache = (products, names, by_name, memo)
+    elif normalized_query in memo:
+        return memo[normalized_query]
+
+    product = _match_normalized(normalized_query, products, names, by_name)
+    if len(memo) >= MATCH_CACHE_MAX:
+        memo.clear()
+    memo[normalized_query] = product
+    return product
+
+
+def _match_normalized(
+    normalized_query: str,
+    products: List[Dict[str, Any]],
+    names: List[str],
+    by_name: Dict[str, Dict[str, Any]],
+) -> Optional[Dict[str, Any]]:
+    exact = by_name.get(normalized_query)
+    if exact is not None:
+        return exact
+
+    words = [w for w in normalized_query.split() if len(w) > 2]
+    if words:
+        for product, name in zip(products, names):
+            if all(w in name for w in words):
+                return product
+
+    close_matches = difflib.get_close_matches(normalized_query, names, n=1, cutoff=0.6)
+    if close_matches:
+        return by_name[close_matches[0]]
+
+    return None
+
+
 # --- Database Tools --- #
 @auto_schema(name_override="get_products")
 async def get_products(ctx: RunContextWrapper[Any]) -> str:
     """Get all available products from the database."""
     try:
-        console.print("[bold blue]📊 Querying products table...[/bold blue]")
-        response = supabase.table("productos").select("*").execute()
-
-        if not response.data:
-            console.print("[bold yellow]⚠️ The query returned no data[/bold yellow]")
-            return "[]"
-
-        # Map Spanish field names to English field names required by the model
-        products_mapped = []
-        for p in response.data:
-            # Transform the keys from Spanish to English
-            product_mapped = {
-                "id": p.get("id"),
-                "name": p.get("nombre"),
-                "brand": p.get("marca"),
-                "price": p.get("precio"),
-                "created_at": p.get("created_at"),
-                "updated_at": p.get("updated_at"),
-            }
-            products_mapped.append(product_mapped)
-
-        # Create product instances with the correctly mapped fields
-        products = [Product(**product) for product in products_mapped]
-
-        console.print(f"[bold green]✅ Found {len(products)} products[/bold green]")
+        # Return products with English field names
+        return orjson.dumps(await fetch_products()).decode()
+    except Exception as e:
+        console.print(f"[bold red]❌ Error in DB query: {str(e)}[/bold red]")
+        return f"Error getting products: {str(e)}"
 
-        for p in products[:3]:
-            console.print(f"[dim]  └─ {p.name}: ${p.price} (ID: {p.id})[/dim]")
 
-        if len(products) > 3:
-            console.print(f"[dim]  └─ ... and {len(products) - 3} more[/dim]")
+@auto_schema(name_override="find_product")
+async def find_product(ctx: RunContextWrapper[Any], query: str) -> str:
+    """Find the product that best matches what the customer asked for.
 
-        # Return products with English field names
-        return str(
-            [
-                {"name": p.name, "brand": p.brand, "price": p.price, "id": p.id}
-                for p in products
-            ]
-        )
+    Args:
+        query: Product name as written by the customer
+    """
+    try:
+        products = await fetch_products()
     except Exception as e:
         console.print(f"[bold red]❌ Error in DB query: {str(e)}[/bold red]")
         return f"Error getting products: {str(e)}"
 
+    product = match_product(query, products)
+    if product is None:
+        return f"NO_MATCH: Could not find a product matching {query}"
+
+    return (
+        f"PRODUCT_INFO: {product['name']} | PRICE: ${product['price']:.2f} | "
+        f"DESC: {product['description'] or ''} | ID: {product['id']} | DB_MATCH: true"
+    )
+
 
 @auto_schema(name_override="get_product")
 async def get_product(ctx: RunContextWrapper[Any], product_id: str) -> str:
@@ -149,34 +435,21 @@ async def get_product(ctx: RunContextWrapper[Any], product_id: str) -> str:
         product_id: The ID of the product to search for
     """
     try:
-        response = (
+        response = await _execute(
             supabase.table("productos")
-            .select("*")
+            .select("nombre,marca,precio")
             .eq("id", product_id)
             .single()
-            .execute()
         )
         if response.data:
-            # Map Spanish field names to English field names required by the model
-            product_mapped = {
-                "id": response.data.get("id"),
-                "name": response.data.get("nombre"),
-                "brand": response.data.get("marca"),
-                "price": response.data.get("precio"),
-                "created_at": response.data.get("created_at"),
-                "updated_at": response.data.get("updated_at"),
-            }
-
-            # Create a product instance with the mapped fields
-            product = Product(**product_mapped)
-
-            return str(
+            # Rename the Spanish columns; the row is returned as-is otherwise
+            return orjson.dumps(
                 {
-                    "name": product.name,
-                    "brand": product.brand,
-                    "price": product.price,
+                    "name": response.data.get("nombre"),
+                    "brand": response.data.get("marca"),
+                    "price": float(response.data.get("precio") or 0),
                 }
-            )
+            ).decode()
         return "Product not found"
     except Exception as e:
         return f"Error getting product: {str(e)}"
@@ -197,21 +470,19 @@ async def create_product(ctx: RunContextWrapper[Any], product: ProductInput) ->
             "precio": product.price,
         }
 
-        response = supabase.table("productos").insert(product_data).execute()
-        if response.data:
-            return f"Product successfully created: {product.name} - {product.brand}"
-        return "Error creating product"
+        # Nothing reads the new row back, so skip echoing it; a failed insert
+        # raises an APIError instead of returning empty data
+        await _execute(
+            supabase.table("productos").insert(product_data, returning="minimal")
+        )
+        invalidate_products_cache()
+        return f"Product successfully created: {product.name} - {product.brand}"
     except Exception as e:
         return f"Error creating product: {str(e)}"
 
 
-@auto_schema(name_override="create_purchase")
-async def create_purchase(ctx: RunContextWrapper[Any], purchase: PurchaseInput) -> str:
-    """Create a new purchase in the database.
-
-    Args:
-        purchase: Purchase data to create
-    """
+async def register_purchase(purchase: PurchaseInput) -> str:
+    """Inserts a purchase and its products, returning a status message."""
     try:
         purchase_data = {
             "monto": float(purchase.amount),
@@ -219,42 +490,47 @@ async def create_purchase(ctx: RunContextWrapper[Any], purchase: PurchaseInput)
             "fecha": datetime.now().isoformat(),
         }
 
-        console.print(
-            f"[bold blue]📝 Creating purchase:[/] Amount: ${purchase.amount}, Type: {purchase.purchase_type_id}"
-        )
-        console.print(f"[dim blue]  └─ Data to insert: {purchase_data}[/dim blue]")
-
-        response_purchase = supabase.table("compras").insert(purchase_data).execute()
-
-        if not response_purchase.data:
+        if DB_TRACE_ENABLED:
             console.print(
-                "[bold red]❌ Error:[/] No response data received when creating purchase"
+                f"[bold blue]📝 Creating purchase:[/] Amount: ${purchase.amount}, Type: {purchase.purchase_type_id}"
             )
-            return "Error creating purchase: No response data received"
+            console.print(f"[dim blue]  └─ Data to insert: {purchase_data}[/dim blue]")
+
+        purchase_record = await _purchase_batcher.submit(purchase_data)
 
-        purchase_id = response_purchase.data[0]["id"]
-        console.print(f"[bold green]✅ Purchase created:[/] ID: {purchase_id}")
+        purchase_id = purchase_record["id"]
+        if DB_TRACE_ENABLED:
+            console.print(f"[bold green]✅ Purchase created:[/] ID: {purchase_id}")
 
-        for product in purchase.products:
-            product_data = {
+        product_rows = [
+            {
                 "compra_id": purchase_id,
                 "producto_id": product.product_id,
                 "cantidad": product.quantity,
                 "precio_unitario": float(product.unit_price),
                 "subtotal": float(product.quantity * product.unit_price),
             }
+            for product in purchase.products
+        ]
 
-            console.print(
-                f"[bold blue]📝 Adding product to purchase:[/] {product.product_id} x{product.quantity}"
-            )
-            product_response = (
-                supabase.table("compras_productos").insert(product_data).execute()
-            )
-
-            if not product_response.data:
+        if product_rows:
+            if DB_TRACE_ENABLED:
                 console.print(
-                    f"[bold red]❌ Error:[/] No data received when adding product {product.product_id}"
+                    f"[bold blue]📝 Adding {len(product_rows)} products to purchase[/]"
                 )
+            # One bulk INSERT for every line item instead of a round trip each.
+            # It is a single statement, so on failure no line item was written
+            # and the purchase row is removed rather than left empty. The rows
+            # are not echoed back since nothing reads them
+            try:
+                await _execute(
+                    supabase.table("compras_productos").insert(
+                        product_rows, returning="minimal"
+                    )
+                )
+            except Exception:
+                await _execute(supabase.table("compras").delete().eq("id", purchase_id))
+                raise
 
         return f"Purchase created successfully. ID: {purchase_id}"
     except Exception as e:
@@ -263,48 +539,66 @@ async def create_purchase(ctx: RunContextWrapper[Any], purchase: PurchaseInput)
         return f"Error creating purchase: {str(e)}"
 
 
-@auto_schema(name_override="get_purchase_types")
-async def get_purchase_types(ctx: RunContextWrapper[Any]) -> str:
-    """Get all available purchase types."""
-    try:
-        response = supabase.table("tipo_compra").select("*").execute()
-
-        # Map Spanish field names to English field names
-        types_mapped = []
-        for t in response.data:
-            type_mapped = {
-                "id": t.get("id"),
-                "name": t.get("nombre", ""),
-                "description": t.get("descripcion", ""),
-                "created_at": t.get("created_at"),
-            }
-            types_mapped.append(type_mapped)
+async def fetch_purchase_types() -> List[Dict[str, str]]:
+    """Returns the purchase types as plain dicts, cached for PURCHASE_TYPES_TTL."""
+    global _purchase_types_cache
 
-        types = [PurchaseType(**type_mapped) for type_mapped in types_mapped]
-        types_list = [
-            {"id": str(t.id), "name": t.name, "description": t.description or ""}
-            for t in types
-        ]
+    now = time.monotonic()
+    if _purchase_types_cache and now - _purchase_types_cache[0] < PURCHASE_TYPES_TTL:
+        if DB_TRACE_ENABLED:
+            console.print("[dim green]  └─ Payment types served from cache[/dim green]")
+        return _purchase_types_cache[1]
 
-        mercado_pago_exists = any(
-            t["name"].lower() == "mercado pago" for t in types_list
+    response = await _execute(
+        supabase.table("tipo_compra").select("id,nombre,descripcion")
+    )
+
+    # Map the Spanish columns straight to the English type fields
+    types_list = [
+        {
+            "id": str(t.get("id")),
+            "name": t.get("nombre") or "",
+            "description": t.get("descripcion") or "",
+        }
+        for t in response.data
+    ]
+
+    mercado_pago_exists = any(t["name"].lower() == "mercado pago" for t in types_list)
+    if not mercado_pago_exists:
+        console.print("[bold yellow]⚠️ Type 'Mercado Pago' not found[/]")
+        console.print(
+            "[dim yellow]  └─ Will use the first available type or create a new one[/dim yellow]"
         )
-        if not mercado_pago_exists:
-            console.print("[bold yellow]⚠️ Type 'Mercado Pago' not found[/]")
+
+        if types_list:
             console.print(
-                "[dim yellow]  └─ Will use the first available type or create a new one[/dim yellow]"
+                f"[dim yellow]  └─ Using type: {types_list[0]['name']} (ID: {types_list[0]['id']})[/dim yellow]"
             )
 
-            if types_list:
-                console.print(
-                    f"[dim yellow]  └─ Using type: {types_list[0]['name']} (ID: {types_list[0]['id']})[/dim yellow]"
-                )
-
-        formatted_output = json.dumps(types_list, ensure_ascii=False, indent=2)
+    _purchase_types_cache = (now, types_list)
+    if DB_TRACE_ENABLED:
         console.print(
             f"[bold green]✅ Payment types retrieved:[/] {len(types_list)} types"
         )
-        return formatted_output
+    return types_list
+
+
+@auto_schema(name_override="create_purchase")
+async def create_purchase(ctx: RunContextWrapper[Any], purchase: PurchaseInput) -> str:
+    """Create a new purchase in the database.
+
+    Args:
+        purchase: Purchase data to create
+    """
+    return await register_purchase(purchase)
+
+
+@auto_schema(name_override="get_purchase_types")
+async def get_purchase_types(ctx: RunContextWrapper[Any]) -> str:
+    """Get all available purchase types."""
+    try:
+        types_list = await fetch_purchase_types()
+        return orjson.dumps(types_list, option=orjson.OPT_INDENT_2).decode()
 
     except Exception as e:
         error_msg = f"Error getting payment types: {str(e)}"
@@ -322,48 +616,45 @@ async def generate_sales_report(
         report: Data to generate the sales report
     """
     try:
-        start_date_dt = datetime.fromisoformat(report.start_date)
-        end_date_dt = datetime.fromisoformat(report.end_date)
-
-        # Get purchases for the period
-        query = (
-            supabase.table("compras")
-            .select("*")
-            .gte("fecha", start_date_dt.isoformat())
-            .lte("fecha", end_date_dt.isoformat())
-        )
-
-        response = query.execute()
-
-        # Map Spanish field names to English field names
-        purchases_mapped = []
-        for p in response.data:
-            purchase_mapped = {
-                "id": p.get("id"),
-                "purchase_number": p.get("numero_compra"),
-                "amount": p.get("monto"),
-                "date": p.get("fecha"),
-                "purchase_type_id": p.get("tipo_compra_id"),
-                "created_at": p.get("created_at"),
-                "updated_at": p.get("updated_at"),
-            }
-            purchases_mapped.append(purchase_mapped)
-
-        purchases = [Purchase(**purchase) for purchase in purchases_mapped]
-
-        # Calculate statistics
-        total_sales = sum(purchase.amount for purchase in purchases)
-        purchase_count = len(purchases)
+        # Postgres parses the dates itself; this only rejects malformed input
+        # (timezone suffixes such as Z or +00:00 are accepted)
+        datetime.fromisoformat(report.start_date)
+        try:
+            end_day = date.fromisoformat(report.end_date)
+        except ValueError:
+            # Not a bare date, so it must be a full timestamp
+            datetime.fromisoformat(report.end_date)
+            end_op, end_value = "lte", report.end_date
+        else:
+            # A bare end date covers that whole day: use the half-open range
+            # [start, end + 1 day) so its later purchases are not cut off
+            end_op, end_value = "lt", (end_day + timedelta(days=1)).isoformat()
+
+        # Only the amounts are needed for the totals, so only that column is
+        # fetched, and they are summed one page at a time
+        total_sales = 0.0
+        purchase_count = 0
+        async for rows in _iter_pages(
+            lambda: supabase.table("compras")
+            .select("monto")
+            .gte("fecha", report.start_date)
+            .filter("fecha", end_op, end_value)
+        ):
+            for p in rows:
+                amount = p.get("monto")
+                if amount is not None:
+                    total_sales += float(amount)
+                    purchase_count += 1
         average_purchase = total_sales / purchase_count if purchase_count > 0 else 0
 
-        return str(
+        return orjson.dumps(
             {
                 "total_sales": total_sales,
                 "purchase_count": purchase_count,
                 "average_purchase": average_purchase,
                 "period": f"From {report.start_date} to {report.end_date}",
             }
-        )
+        ).decode()
     except Exception as e:
         return f"Error generating report: {str(e)}"
 
@@ -379,21 +670,23 @@ async def test_connection(ctx: RunContextWrapper[Any]) -> str:
             "descripcion": "This is a test product to verify connection",
         }
 
-        insert_response = supabase.table("productos").insert(test_product).execute()
+        insert_response = await _execute(
+            supabase.table("productos").insert(test_product)
+        )
 
         if not insert_response.data:
             return "❌ Error: Could not insert test product"
 
         product_id = insert_response.data[0]["id"]
 
-        read_response = (
-            supabase.table("productos").select("*").eq("id", product_id).execute()
+        read_response = await _execute(
+            supabase.table("productos").select("*").eq("id", product_id)
         )
 
         if not read_response.data:
             return "❌ Error: Could not read test product"
 
-        supabase.table("productos").delete().eq("id", product_id).execute()
+        await _execute(supabase.table("productos").delete().eq("id", product_id))
 
         return "✅ Successful connection: Test product was created, read and deleted"
 
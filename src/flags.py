@@ -0,0 +1,21 @@
+import os
+from rich.console import Console
+
+_TRUTHY = frozenset({"1", "true", "yes", "on"})
+
+
+def env_flag(name: str) -> bool:
+    """Reads an on/off switch from the environment.
+
+    Unset (or empty) means on for an interactive terminal and off otherwise;
+    1/true/yes/on force it on, and any other value turns it off.
+    """
+    value = os.getenv(name, "").strip().lower()
+    if not value:
+        return Console().is_terminal
+    return value in _TRUTHY
+
+
+# Read once at import; src.whatsapp.config loads .env before any importer.
+# Gates the Rich progress output of the agents and the payment helpers
+VERBOSE_LOGS = env_flag("VERBOSE_LOGS")
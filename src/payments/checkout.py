@@ -0,0 +1,83 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from agents import RunContextWrapper, function_tool
+from rich.console import Console
+
+from ..db.database import fetch_purchase_types, register_purchase
+from ..db.models import PurchaseInput, PurchaseProductInput
+from .mp import generate_payment_link
+
+console = Console()
+
+MERCADO_PAGO_TYPE_NAME = "mercado pago"
+
+
+def _pick_purchase_type_id(types_list: List[Dict[str, str]]) -> Optional[str]:
+    """Returns the "Mercado Pago" type ID, falling back to the first available type"""
+    for purchase_type in types_list:
+        if purchase_type["name"].lower() == MERCADO_PAGO_TYPE_NAME:
+            return purchase_type["id"]
+    return types_list[0]["id"] if types_list else None
+
+
+async def _register_order(amount: float, products: List[PurchaseProductInput]) -> str:
+    """Resolves the purchase type and registers the purchase, returning its status"""
+    try:
+        purchase_types = await fetch_purchase_types()
+    except Exception as e:
+        return f"Error creating purchase: {str(e)}"
+
+    purchase_type_id = _pick_purchase_type_id(purchase_types)
+    if purchase_type_id is None:
+        return "Error creating purchase: No payment types available"
+
+    return await register_purchase(
+        PurchaseInput(
+            amount=amount,
+            purchase_type_id=purchase_type_id,
+            products=products,
+        )
+    )
+
+
+@function_tool(name_override="prepare_payment")
+async def prepare_payment(
+    ctx: RunContextWrapper[Any],
+    amount: float,
+    products: List[PurchaseProductInput],
+) -> str:
+    """
+    Generates the Mercado Pago payment link and registers the purchase.
+
+    The payment link does not depend on the purchase, so the Mercado Pago request
+    and the purchase inserts run concurrently.
+
+    Args:
+        ctx: The context wrapper
+        amount: Exact total amount of the order
+        products: Products in the order with their quantities and unit prices
+
+    Returns:
+        str: PAYMENT_INFO line, followed by the purchase error if registering failed
+    """
+    order_id = str(int(datetime.now().timestamp()))
+
+    payment_link, purchase_status = await asyncio.gather(
+        generate_payment_link(amount, f"Order #{order_id}", "Food order", order_id),
+        _register_order(amount, products),
+        return_exceptions=True,
+    )
+
+    if isinstance(payment_link, BaseException):
+        console.print(f"[bold red]❌ MP ERROR[/]: {str(payment_link)}")
+        payment_link = f"https://link.mercadopago.com/error-exception-{order_id}"
+
+    if isinstance(purchase_status, BaseException):
+        purchase_status = f"Error creating purchase: {str(purchase_status)}"
+
+    payment_info = f"PAYMENT_INFO: Total: ${amount:.2f} | Link: {payment_link} | Order_ID: {order_id}"
+    if purchase_status.startswith("Error"):
+        return f"{payment_info}\n{purchase_status}"
+    return payment_info
@@ -1,15 +1,29 @@
+import asyncio
+import atexit
 import os
-from dotenv import load_dotenv
-import mercadopago
-from typing import Any, Callable, Optional
-from agents import function_tool, RunContextWrapper
-from functools import wraps
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict, Optional, Tuple
 from datetime import datetime, timedelta
 from rich.console import Console
 
+# Progress output follows VERBOSE_LOGS like the agent logs; errors are always
+# printed
+from ..flags import VERBOSE_LOGS as MP_VERBOSE
+
 console = Console()
 
-load_dotenv()
+MP_API_URL = "https://api.mercadopago.com"
+MP_TIMEOUT = 10  # seconds
+# Read once at import; src.whatsapp.config loads .env before this module
+MP_ACCESS_TOKEN = os.environ.get("MP_ACCESS_TOKEN")
+MP_DEV_MODE = os.environ.get("MP_DEV_MODE", "false").lower() == "true"
+
+# One keep-alive session for every Mercado Pago call, so consecutive payments
+# reuse the TCP/TLS connection instead of handshaking each time
+_mp_session = requests.Session()
+_mp_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=10))
+atexit.register(_mp_session.close)
 
 
 def get_apps_script_endpoint():
@@ -33,36 +47,29 @@ def get_apps_script_endpoint():
     return webhook_url
 
 
-def auto_schema(name_override: str):
-    """Decorator that automatically generates the JSON schema for database functions.
-
-    Args:
-        name_override: Function name for the agent
-    """
-
-    def decorator(func: Callable):
-        @wraps(func)
-        async def wrapper(ctx: RunContextWrapper[Any], *args, **kwargs):
-            return await func(ctx, *args, **kwargs)
-
-        return function_tool(name_override=name_override)(wrapper)
-
-    return decorator
+def _create_preference(
+    mp_token: str, preference_data: Dict[str, Any]
+) -> Tuple[int, Dict[str, Any]]:
+    """Creates a checkout preference through the pooled session (blocking)"""
+    response = _mp_session.post(
+        f"{MP_API_URL}/checkout/preferences",
+        json=preference_data,
+        headers={"Authorization": f"Bearer {mp_token}"},
+        timeout=MP_TIMEOUT,
+    )
+    return response.status_code, response.json()
 
 
-@auto_schema(name_override="create_mercadopago_link")
-async def create_mercadopago_link(
-    ctx: RunContextWrapper[Any],
+async def generate_payment_link(
     amount: float,
     title: str,
     description: str,
     external_reference: Optional[str] = None,
-):
+) -> str:
     """
-    Creates a Mercado Pago payment link.
+    Creates a Mercado Pago payment link outside of the agent tool layer.
 
     Args:
-        ctx: The context wrapper
         amount: Price of the item (as float)
         title: Title of the purchase
         description: Optional description
@@ -71,22 +78,26 @@ async def create_mercadopago_link(
     Returns:
         str: The payment link URL
     """
-    mp_token = os.environ.get("MP_ACCESS_TOKEN")
-    dev_mode = os.environ.get("MP_DEV_MODE", "false").lower() == "true"
-
-    console.print(f"\n[bold cyan]💰 MERCADO PAGO[/]: Generating payment link...")
-    console.print(f"[dim cyan]  └─ Amount: ${amount}[/dim cyan]")
-    console.print(f"[dim cyan]  └─ Title: {title}[/dim cyan]")
-    console.print(
-        f"[dim cyan]  └─ Development mode: {'Enabled' if dev_mode else 'Disabled'}[/dim cyan]"
-    )
+    mp_token = MP_ACCESS_TOKEN
+    dev_mode = MP_DEV_MODE
+
+    # One order id serves every path, errors included; the caller's reference
+    # wins so the link matches the purchase it registered
+    order_id = external_reference or int(datetime.now().timestamp())
+
+    if MP_VERBOSE:
+        console.print(f"\n[bold cyan]💰 MERCADO PAGO[/]: Generating payment link...")
+        console.print(f"[dim cyan]  └─ Amount: ${amount}[/dim cyan]")
+        console.print(f"[dim cyan]  └─ Title: {title}[/dim cyan]")
+        console.print(
+            f"[dim cyan]  └─ Development mode: {'Enabled' if dev_mode else 'Disabled'}[/dim cyan]"
+        )
 
     if mp_token is None:
         console.print(
             "[bold red]❌ MP ERROR[/]: MP_ACCESS_TOKEN not configured in environment variables"
         )
         if dev_mode:
-            order_id = int(datetime.now().timestamp())
             mock_link = f"https://link.mercadopago.com/error-no-token"
             console.print(
                 f"[bold yellow]⚠️ DEV MODE[/]: Generating mock link: {mock_link}"
@@ -95,19 +106,20 @@ async def create_mercadopago_link(
         return "https://link.mercadopago.com/error-no-token"
 
     try:
-        order_id = int(datetime.now().timestamp())
-
         if dev_mode:
             mock_link = (
                 f"https://link.mercadopago.com/test-payment-{order_id}?amount={amount}"
             )
-            console.print(
-                f"[bold green]✅ DEV MODE[/]: Test link generated: {mock_link}"
-            )
+            if MP_VERBOSE:
+                console.print(
+                    f"[bold green]✅ DEV MODE[/]: Test link generated: {mock_link}"
+                )
             return mock_link
 
-        sdk = mercadopago.SDK(mp_token)
-        console.print(f"[bold yellow]⏳ PROCESSING[/]: Connecting to Mercado Pago...")
+        if MP_VERBOSE:
+            console.print(
+                f"[bold yellow]⏳ PROCESSING[/]: Connecting to Mercado Pago..."
+            )
 
         item = {
             "title": title,
@@ -134,31 +146,35 @@ async def create_mercadopago_link(
             "expiration_date_to": (datetime.now() + timedelta(hours=24)).isoformat(),
         }
 
-        console.print(
-            "[bold yellow]⏳ PROCESSING[/]: Sending request to MercadoPago..."
-        )
+        if MP_VERBOSE:
+            console.print(
+                "[bold yellow]⏳ PROCESSING[/]: Sending request to MercadoPago..."
+            )
 
-        preference_response = sdk.preference().create(preference_data)
-        preference = preference_response["response"]
+        # Run the blocking request in a worker thread so the event loop stays free
+        status, preference = await asyncio.to_thread(
+            _create_preference, mp_token, preference_data
+        )
 
-        if preference_response["status"] != 201:
+        if status != 201:
             console.print(
-                f"[bold red]❌ MP ERROR[/]: Error creating preference: {preference_response['response']}"
+                f"[bold red]❌ MP ERROR[/]: Error creating preference: {preference}"
             )
             return f"https://link.mercadopago.com/error-{order_id}"
 
         payment_link = preference["init_point"]
-        console.print(f"[bold green]✅ SUCCESS[/]: Link generated: {payment_link}")
+        if MP_VERBOSE:
+            console.print(f"[bold green]✅ SUCCESS[/]: Link generated: {payment_link}")
         return payment_link
 
     except Exception as e:
         console.print(f"[bold red]❌ MP ERROR[/]: {str(e)}")
 
         if dev_mode:
-            mock_link = f"https://link.mercadopago.com/error-exception-{int(datetime.now().timestamp())}"
+            mock_link = f"https://link.mercadopago.com/error-exception-{order_id}"
             console.print(
                 f"[bold yellow]⚠️ DEV MODE[/]: Generating mock link due to error: {mock_link}"
             )
             return mock_link
 
-        return f"https://link.mercadopago.com/error-exception-{int(datetime.now().timestamp())}"
+        return f"https://link.mercadopago.com/error-exception-{order_id}"
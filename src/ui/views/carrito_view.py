@@ -2,8 +2,10 @@ from rich.table import Table
 from rich.console import Console
 from rich.panel import Panel
 from rich.text import Text
+from operator import attrgetter
 
 console = Console()
+_get_item_fields = attrgetter("producto", "cantidad", "precio_unitario")
 
 
 class CarritoView:
@@ -27,22 +29,14 @@ class CarritoView:
 
         total = 0
 
-        for item_key, item_data in carrito.items():
-            producto = item_data.producto
-            cantidad = item_data.cantidad
-            precio = (
-                item_data.precio_unitario
-                if item_data.precio_unitario is not None
-                else 0
-            )
+        for producto, cantidad, precio in map(_get_item_fields, carrito.values()):
+            if precio is None:
+                precio = 0
 
             subtotal = cantidad * precio
             total += subtotal
 
-            precio_str = f"${precio:.2f}" if precio is not None else "Pending"
-            subtotal_str = f"${subtotal:.2f}" if precio is not None else "Pending"
-
-            table.add_row(producto, str(cantidad), precio_str, subtotal_str)
+            table.add_row(producto, str(cantidad), f"${precio:.2f}", f"${subtotal:.2f}")
 
         table.add_row("TOTAL", "", "", f"${total:.2f}", style="bold")
 
@@ -55,19 +49,16 @@ class CarritoView:
         table.add_column("Detail", style="cyan")
         table.add_column("Information", style="green")
 
-        total = sum(
-            item.cantidad
-            * (item.precio_unitario if item.precio_unitario is not None else 0)
-            for item in carrito.values()
-        )
+        # One pass over the cart builds both the total and the product list
+        total = 0
+        productos = []
+        for item in carrito.values():
+            precio = item.precio_unitario if item.precio_unitario is not None else 0
+            total += item.cantidad * precio
+            productos.append(f"{item.cantidad} {item.producto}")
 
         table.add_row("Number of products:", str(len(carrito)))
-        table.add_row(
-            "Products:",
-            ", ".join(
-                [f"{item.cantidad} {item.producto}" for item in carrito.values()]
-            ),
-        )
+        table.add_row("Products:", ", ".join(productos))
         table.add_row("Total to pay:", f"${total:.2f}")
 
         if metodo_pago:
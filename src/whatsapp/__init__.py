@@ -1,6 +1,7 @@
 from flask import Flask
 from .config import load_configurations, configure_logging
 from .views import webhook_blueprint
+from src.agents.agents import get_agents
 
 
 def create_app():
@@ -13,4 +14,7 @@ def create_app():
     # Import and register blueprints, if any
     app.register_blueprint(webhook_blueprint)
 
+    # Build the agent graph at startup instead of on the first message
+    get_agents()
+
     return app
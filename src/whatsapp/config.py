@@ -3,11 +3,12 @@ import os
 from dotenv import load_dotenv
 import logging
 
+# The app's only .env load. src.whatsapp imports this module before its views
+# and the agents, so every module-level os.environ read sees the file's values
 load_dotenv()
 
 
 def load_configurations(app):
-    load_dotenv()
     app.config["ACCESS_TOKEN"] = os.getenv("ACCESS_TOKEN")
     app.config["YOUR_PHONE_NUMBER"] = os.getenv("YOUR_PHONE_NUMBER")
     app.config["APP_ID"] = os.getenv("APP_ID")
@@ -4,7 +4,7 @@ from typing import List, Dict, Any, Optional
 interactive message types we use in this project.
 
 Each function returns a **Python dict** ready to be serialised with
-``json.dumps`` and POST-ed to the WhatsApp endpoint.  Keeping the payload as a
+``orjson.dumps`` and POST-ed to the WhatsApp endpoint.  Keeping the payload as a
 Python structure makes unit-testing easier and avoids double serialization
 mistakes.
 
@@ -20,6 +20,27 @@ new use-cases appear.
 WHATSAPP_PRODUCT = "whatsapp"
 RECIPIENT_TYPE = "individual"
 
+# Envelope fields every payload starts with; copied into each new dict
+_BASE: Dict[str, str] = {
+    "messaging_product": WHATSAPP_PRODUCT,
+    "recipient_type": RECIPIENT_TYPE,
+}
+
+
+def _interactive_payload(
+    recipient: str,
+    interactive: Dict[str, Any],
+    header_text: Optional[str],
+    footer_text: Optional[str],
+) -> Dict[str, Any]:
+    """Add the optional header/footer and wrap *interactive* in the envelope."""
+    if header_text:
+        interactive["header"] = {"type": "text", "text": header_text}
+    if footer_text:
+        interactive["footer"] = {"text": footer_text}
+    return {**_BASE, "to": recipient, "type": "interactive", "interactive": interactive}
+
+
 # ---------------------------------------------------------------------------
 # Text message
 # ---------------------------------------------------------------------------
@@ -28,8 +49,7 @@ RECIPIENT_TYPE = "individual"
 def build_text_message(recipient: str, body_text: str) -> Dict[str, Any]:
     """Return a simple text-only payload."""
     return {
-        "messaging_product": WHATSAPP_PRODUCT,
-        "recipient_type": RECIPIENT_TYPE,
+        **_BASE,
         "to": recipient,
         "type": "text",
         "text": {
@@ -67,18 +87,7 @@ def build_cta_url_message(
         },
     }
 
-    if header_text:
-        interactive["header"] = {"type": "text", "text": header_text}
-    if footer_text:
-        interactive["footer"] = {"text": footer_text}
-
-    return {
-        "messaging_product": WHATSAPP_PRODUCT,
-        "recipient_type": RECIPIENT_TYPE,
-        "to": recipient,
-        "type": "interactive",
-        "interactive": interactive,
-    }
+    return _interactive_payload(recipient, interactive, header_text, footer_text)
 
 
 # ---------------------------------------------------------------------------
@@ -118,18 +127,7 @@ def build_list_message(
         },
     }
 
-    if header_text:
-        interactive["header"] = {"type": "text", "text": header_text}
-    if footer_text:
-        interactive["footer"] = {"text": footer_text}
-
-    return {
-        "messaging_product": WHATSAPP_PRODUCT,
-        "recipient_type": RECIPIENT_TYPE,
-        "to": recipient,
-        "type": "interactive",
-        "interactive": interactive,
-    }
+    return _interactive_payload(recipient, interactive, header_text, footer_text)
 
 
 # ---------------------------------------------------------------------------
@@ -160,15 +158,4 @@ def build_reply_buttons_message(
         },
     }
 
-    if header_text:
-        interactive["header"] = {"type": "text", "text": header_text}
-    if footer_text:
-        interactive["footer"] = {"text": footer_text}
-
-    return {
-        "messaging_product": WHATSAPP_PRODUCT,
-        "recipient_type": RECIPIENT_TYPE,
-        "to": recipient,
-        "type": "interactive",
-        "interactive": interactive,
-    }
+    return _interactive_payload(recipient, interactive, header_text, footer_text)
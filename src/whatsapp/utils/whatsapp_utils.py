@@ -1,9 +1,16 @@
 import logging
-import json
+import orjson
 import asyncio
-from typing import Optional, List, Dict, Any
+import atexit
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import List, Dict, Any, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 from flask import current_app, jsonify
 import re
 from .interactive_builder import (
@@ -11,21 +18,91 @@ from .interactive_builder import (
     build_cta_url_message,
     build_list_message,
 )
-from src.agents.agents import Agents, ChatContext
+from src.agents.agents import (
+    PAYMENT_INFO_RE,
+    PRODUCT_INFO_RE,
+    ChatContext,
+    get_agents,
+)
 from src.db.supabase_client import supabase
 
-# Instantiate the Agents system once so it can be reused across requests
-_agents_instance: Optional[Agents] = None
+# Store ChatContext per WhatsApp user (wa_id) so the conversation persists.
+# Kept in least-recently-used order and capped, so idle users are dropped
+# instead of growing memory forever
+MAX_CONTEXTS = 10_000
+_contexts: "OrderedDict[str, ChatContext]" = OrderedDict()
+_contexts_lock = threading.Lock()
+
+# Meta re-delivers a webhook when the reply is slow; remember recent message
+# ids so a redelivery does not run the agents a second time. An id is released
+# again if its turn fails or times out, so Meta's retry gets answered
+SEEN_MESSAGES_MAX = 1024
+_seen_message_ids: "OrderedDict[str, None]" = OrderedDict()
+_seen_messages_lock = threading.Lock()
+
+# Every new user gets the same greeting catalog, so reuse the rows briefly
+CATALOG_TTL = 60  # seconds
+_catalog_cache: Optional[Tuple[float, List[Dict[str, str]]]] = None
+
+# One keep-alive session for the Graph API, so consecutive sends reuse the
+# TCP/TLS connection instead of handshaking for every message
+_wa_session = requests.Session()
+_wa_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=10))
+atexit.register(_wa_session.close)
 
-# Store ChatContext per WhatsApp user (wa_id) so the conversation persists
-_contexts: Dict[str, ChatContext] = {}
+# Agent turns run on one long-lived event loop in a background thread instead
+# of a fresh asyncio.run loop per message; Flask workers block on the result
+AGENT_RESPONSE_TIMEOUT = 120  # seconds
+_agent_loop: Optional[asyncio.AbstractEventLoop] = None
+_agent_loop_lock = threading.Lock()
 
 
-def _get_agents() -> Agents:
-    global _agents_instance
-    if _agents_instance is None:
-        _agents_instance = Agents()
-    return _agents_instance
+def _get_agent_loop() -> asyncio.AbstractEventLoop:
+    """Returns the shared agent event loop, starting its thread on first use."""
+    global _agent_loop
+    with _agent_loop_lock:
+        if _agent_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="agent-loop", daemon=True
+            ).start()
+            _agent_loop = loop
+    return _agent_loop
+
+
+def _get_context(wa_id: str) -> ChatContext:
+    """Returns the user's ChatContext, creating it and evicting the oldest if full."""
+    with _contexts_lock:
+        context = _contexts.get(wa_id)
+        if context is None:
+            context = ChatContext(uid=wa_id)
+            _contexts[wa_id] = context
+            if len(_contexts) > MAX_CONTEXTS:
+                _contexts.popitem(last=False)
+        else:
+            _contexts.move_to_end(wa_id)
+    return context
+
+
+def _is_duplicate_message(message_id: Optional[str]) -> bool:
+    """Records message_id and reports whether it was already processed."""
+    if not message_id:
+        return False
+    with _seen_messages_lock:
+        if message_id in _seen_message_ids:
+            return True
+        _seen_message_ids[message_id] = None
+        if len(_seen_message_ids) > SEEN_MESSAGES_MAX:
+            _seen_message_ids.popitem(last=False)
+    return False
+
+
+def _forget_message(message_id: Optional[str]) -> None:
+    """Releases message_id so a redelivery of an unanswered message is processed."""
+    if not message_id:
+        return
+    with _seen_messages_lock:
+        _seen_message_ids.pop(message_id, None)
 
 
 def log_http_response(response):
@@ -43,15 +120,18 @@ def send_message(payload: Dict):
     url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
     # Prevent sending duplicates: fetch ChatContext by waid
     context = _contexts.get(payload.get("to"))
-    payload_str = json.dumps(payload, sort_keys=True)
-    if context and getattr(context, "last_sent_payload", None) == payload_str:
+    # Encoded once: the sorted bytes are the request body, and their 16-byte
+    # digest is all each context keeps for dedup
+    payload_bytes = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    payload_hash = hashlib.blake2b(payload_bytes, digest_size=16).digest()
+    if context and getattr(context, "last_sent_hash", None) == payload_hash:
         print("Duplicate payload suppressed")
         return
     if context:
-        context.last_sent_payload = payload_str
+        context.last_sent_hash = payload_hash
     try:
-        response = requests.post(
-            url, data=json.dumps(payload), headers=headers, timeout=10
+        response = _wa_session.post(
+            url, data=payload_bytes, headers=headers, timeout=10
         )
         response.raise_for_status()
     except requests.Timeout:
@@ -65,31 +145,40 @@ def send_message(payload: Dict):
         return response
 
 
+# Source citation markers (【...】) and Markdown bold (**...**), compiled once
+_CITATION_RE = re.compile(r"\【.*?\】")
+_BOLD_RE = re.compile(r"\*\*(.*?)\*\*")
+
+
 def process_text_for_whatsapp(text):
-    pattern = r"\【.*?\】"
-    text = re.sub(pattern, "", text).strip()
-    pattern = r"\*\*(.*?)\*\*"
-    replacement = r"*\1*"
-    whatsapp_style_text = re.sub(pattern, replacement, text)
-    return whatsapp_style_text
+    text = _CITATION_RE.sub("", text).strip()
+    return _BOLD_RE.sub(r"*\1*", text)
 
 
 def _build_catalog_rows(limit: int = 10) -> List[Dict[str, str]]:
+    global _catalog_cache
+
+    now = time.monotonic()
+    if _catalog_cache and now - _catalog_cache[0] < CATALOG_TTL:
+        return _catalog_cache[1][:limit]
     try:
-        products_resp = supabase.table("productos").select("*").execute()
+        products_resp = (
+            supabase.table("productos")
+            .select("id,nombre,precio")
+            .limit(limit)
+            .execute()
+        )
         products = products_resp.data or []
     except Exception as exc:
         logging.error(f"Error fetching products for catalog: {exc}")
         return []
-    rows: List[Dict[str, str]] = []
-    for p in products[:limit]:
-        rows.append(
-            {
-                "id": p.get("id", p.get("nombre")),
-                "title": p.get("nombre"),
-                "description": f"${p.get('precio')}",
-            }
-        )
+    # id, nombre and precio are always selected above, so index them directly
+    rows: List[Dict[str, str]] = [
+        {"id": p["id"], "title": p["nombre"], "description": f"${p['precio']}"}
+        for p in products
+    ]
+    if rows:
+        _catalog_cache = (now, rows)
     return rows
 
 
@@ -98,14 +187,17 @@ def _send_initial_catalog(recipient_waid: str) -> None:
         "¡Hola! 😊 Bienvenido/a. Aquí tienes nuestro catálogo actual de productos. "
         "Selecciona el que más te guste o dime si necesitas ayuda."
     )
-    send_message(build_text_message(recipient_waid, welcome_text))
     rows = _build_catalog_rows()
     if not rows:
+        send_message(build_text_message(recipient_waid, welcome_text))
         return
+    # The greeting rides in the list body, so the user gets one message (and
+    # one Graph API round trip) instead of a text followed by the menu.
+    # List headers are capped at 60 characters, too short for the greeting
     sections = [{"title": "Menú", "rows": rows}]
     list_payload = build_list_message(
         recipient_waid,
-        body_text="Elige tu producto favorito:",
+        body_text=f"{welcome_text}\n\nElige tu producto favorito:",
         button_text="Ver menú 🍕",
         sections=sections,
     )
@@ -117,6 +209,9 @@ def process_whatsapp_message(body):
     wa_id = value["contacts"][0]["wa_id"] if value.get("contacts") else None
     name = value["contacts"][0]["profile"]["name"] if value.get("contacts") else None
     message = value["messages"][0]
+    if _is_duplicate_message(message.get("id")):
+        logging.info(f"Duplicate delivery of message {message['id']} skipped")
+        return
     # Determine user input depending on type (text / list_reply / button_reply)
     message_body: str
     if message["type"] == "text":
@@ -134,13 +229,8 @@ def process_whatsapp_message(body):
     else:
         logging.info(f"Unsupported message type: {message['type']}")
         return
-    context = _contexts.get(wa_id)
-    if context is None:
-        context = ChatContext()
-        _contexts[wa_id] = context
-    # Add the user message to the context BEFORE checking is_first_message
-    context.add_message("user", message_body)
-    is_first_message = len(context.messages) == 1
+    context = _get_context(wa_id)
+    is_first_message = not context.messages
     recipient_waid = (
         current_app.config["RECIPIENT_WAID"]
         .split()[0]
@@ -148,49 +238,46 @@ def process_whatsapp_message(body):
         .replace("'", "")
     )
     if is_first_message:
+        # The greeting turn never reaches the agents, so record it here;
+        # later turns are recorded by Agents.run itself
+        context.add_message("user", message_body)
         _send_initial_catalog(recipient_waid)
         return
 
     async def _generate_response():
-        agents = _get_agents()
+        agents = get_agents()
         return await agents.run(message_body, context=context)
 
+    future = asyncio.run_coroutine_threadsafe(_generate_response(), _get_agent_loop())
     try:
-        response = asyncio.run(_generate_response())
-    except RuntimeError:
-        response = asyncio.get_event_loop().run_until_complete(_generate_response())
+        response = future.result(timeout=AGENT_RESPONSE_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        _forget_message(message.get("id"))
+        logging.error(f"Agent response timed out after {AGENT_RESPONSE_TIMEOUT}s")
+        return
+    except Exception:
+        _forget_message(message.get("id"))
+        raise
     if not response:
         return
     if isinstance(response, str) and "NO_MATCH:" in response:
         return
     # Decide message type: CTA / LIST / TEXT
     payload: Dict
-    if isinstance(response, str) and "PAYMENT_INFO:" in response:
-        parts = [p.strip() for p in response.split("|")]
-        total = link = ""
-        for p in parts:
-            if p.startswith("PAYMENT_INFO: Total:"):
-                total = p.replace("PAYMENT_INFO: Total:", "").strip()
-            elif p.startswith("Link:"):
-                link = p.replace("Link:", "").strip()
-        body_text = f"Your order is ready! Total {total}. Tap the button to pay."
+    has_info = isinstance(response, str) and "_INFO:" in response
+    if has_info and (payment_match := PAYMENT_INFO_RE.search(response)):
+        body_text = f"Your order is ready! Total {payment_match['total']}. Tap the button to pay."
         payload = build_cta_url_message(
             recipient_waid,
             body_text=body_text,
             button_text="Pay now 💳",
-            url=link,
+            url=payment_match["link"],
         )
-    elif isinstance(response, str) and "PRODUCT_INFO:" in response:
-        first_line = response.split("\n")[0]
-        parts = [p.strip() for p in first_line.split("|")]
-        name = price = ""
-        for p in parts:
-            if p.startswith("PRODUCT_INFO:"):
-                name = p.replace("PRODUCT_INFO:", "").strip()
-            elif p.startswith("PRICE:"):
-                price = p.replace("PRICE:", "").strip()
+    elif has_info and (product_match := PRODUCT_INFO_RE.search(response)):
         confirm_text = (
-            f"Excelente elección! 🍕 He agregado {name} por {price} a tu pedido. "
+            f"Excelente elección! 🍕 He agregado {product_match['name']} por "
+            f"{product_match['price']} a tu pedido. "
             "¿Te gustaría agregar algo más o proceder al pago?"
         )
         payload = build_text_message(recipient_waid, confirm_text)
@@ -203,19 +290,16 @@ def process_whatsapp_message(body):
 
 
 def is_valid_whatsapp_message(body):
-    if not (
-        body.get("object")
-        and body.get("entry")
-        and body["entry"][0].get("changes")
-        and body["entry"][0]["changes"][0].get("value")
-        and body["entry"][0]["changes"][0]["value"].get("messages")
-        and body["entry"][0]["changes"][0]["value"]["messages"][0]
-    ):
+    if not body.get("object"):
+        return False
+    # One descent to the message; any missing or empty level means invalid
+    try:
+        message = body["entry"][0]["changes"][0]["value"]["messages"][0]
+    except (KeyError, IndexError, TypeError):
         return False
-    from_id = body["entry"][0]["changes"][0]["value"]["messages"][0].get("from")
-    if from_id in {
+    if not message:
+        return False
+    return message.get("from") not in {
         current_app.config.get("RECIPIENT_WAID", ""),
         current_app.config.get("PHONE_NUMBER_ID", ""),
-    }:
-        return False
-    return True
+    }